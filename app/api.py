@@ -1,6 +1,30 @@
 import json
 from bottle import HTTPResponse
 
+# Parse requests with a faster JSON library, if there's one installed
+try:
+    from orjson import loads
+except ImportError:
+    try:
+        from ujson import loads
+    except ImportError:
+        from json import loads
+
+# There are only four moves, so their response bodies are serialized up front
+MOVE_BODIES = dict((move, json.dumps({"move": move})) for move in ['up', 'down', 'left', 'right'])
+
+
+def read_json(request):
+    return loads(request.body.read() or b'null')
+
+
+# Starts and ends are answered whatever they send, so a body that isn't JSON is read as None
+def read_optional_json(request):
+    try:
+        return read_json(request)
+    except ValueError:
+        return None
+
 
 def ping_response():
     return HTTPResponse(
@@ -24,16 +48,36 @@ def start_response(color):
 
 
 def move_response(move):
-    assert move in ['up', 'down', 'left', 'right'], \
+    assert move in MOVE_BODIES, \
         "Move must be one of [up, down, left, right]"
 
+    return HTTPResponse(
+        status=200,
+        headers={
+            "Content-Type": "application/json"
+        },
+        body=MOVE_BODIES[move]
+    )
+
+
+def metrics_response(text):
+    return HTTPResponse(
+        status=200,
+        headers={
+            "Content-Type": "text/plain; version=0.0.4"
+        },
+        body=text
+    )
+
+
+def batch_response(moves):
     return HTTPResponse(
         status=200,
         headers={
             "Content-Type": "application/json"
         },
         body=json.dumps({
-            "move": move
+            "moves": moves
         })
     )
 
@@ -0,0 +1,106 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.context import Context
+from app.games import games
+from app.mover import Mover
+
+# Processes to work out moves in
+DEFAULT_WORKERS = int(os.getenv('WORKERS', os.cpu_count() or 1))
+
+# Pool for batches sent to the bottle app, started on the first batch
+_pool = None
+
+
+def read_batch(data, dna='', traits=''):
+    # type: (list, str, str) -> list
+    """
+    Reads a batch of move requests, each of which can have its own "dna" and "traits".
+    :param data: List of move requests.
+    :param dna: DNA for requests that don't have their own.
+    :param traits: Traits for requests that don't have their own.
+    :return: (dna, traits, data) for each request.
+    """
+    return [(request.get('dna', dna), request.get('traits', traits), request) for request in data]
+
+
+def group_requests(requests, workers):
+    # type: (list, int) -> list
+    """
+    Groups requests from the same game and turn, so they only parse their board once,
+    then splits up the biggest groups until there's a group for every worker.
+    :param requests: (dna, traits, data) for each request.
+    :param workers: Number of workers the groups are shared between.
+    :return: Groups of (index, dna, traits, data), where index is the request's position in the batch.
+    """
+    games = {}
+
+    for index, (dna, traits, data) in enumerate(requests):
+        games.setdefault((data['game']['id'], data['turn']), []).append((index, dna, traits, data))
+
+    groups = list(games.values())
+
+    while groups and len(groups) < workers:
+        largest = max(groups, key=len)
+
+        if len(largest) < 2:
+            break
+
+        groups.remove(largest)
+        groups += [largest[:len(largest) // 2], largest[len(largest) // 2:]]
+
+    return groups
+
+
+def move_group(group, deadline=None):
+    # type: (list, float) -> list
+    """
+    Works out the moves for a group of requests from the same game and turn. This runs in the worker processes,
+    each with its own game cache, the same as moves sent to the async server. A worker only remembers what snakes
+    have done on the turns of a game it's been sent, so a game's groups can see less history than a single
+    process serving /move would.
+    :param group: (index, dna, traits, data) for each request.
+    :param deadline: Time by which every move has to be worked out.
+    :return: (index, direction) for each request.
+    """
+    moves = []
+    shared = None
+
+    for number, (index, dna, traits, data) in enumerate(group):
+        context = Context(data, dna, traits, games, shared=shared)
+        shared = shared or context
+
+        # Every move gets an even share of the time that's left, so one long search can't leave the rest without any
+        move_deadline = None
+        if deadline is not None:
+            move_deadline = time.time() + max(deadline - time.time(), 0) / (len(group) - number)
+
+        moves.append((index, Mover(context).next_move(move_deadline)))
+
+    return moves
+
+
+def move_batch(requests, deadline=None, pool=None, workers=DEFAULT_WORKERS):
+    # type: (list, float, ProcessPoolExecutor, int) -> list
+    """
+    Works out the moves for a batch of requests in parallel, with the same decisions as they'd get one at a time.
+    :param requests: (dna, traits, data) for each request.
+    :param deadline: Time by which every move has to be worked out.
+    :param pool: Pool to work out the moves in, defaults to one shared by every batch in this process.
+    :param workers: Number of workers in the pool.
+    :return: Direction for each request, in the same order.
+    """
+    global _pool
+
+    if pool is None:
+        pool = _pool = _pool or ProcessPoolExecutor(workers)
+
+    groups = group_requests(requests, workers)
+    directions = [None] * len(requests)
+
+    for moves in pool.map(move_group, groups, [deadline] * len(groups)):
+        for index, direction in moves:
+            directions[index] = direction
+
+    return directions
@@ -0,0 +1,299 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import timeit
+
+import bottle
+
+from app.api import loads, move_response, read_json
+from app.context import Context
+from app.geometry import STANDARD_SIZES
+from app.main import warm_up
+from app.mover import Mover
+from app.simulator import percentile
+from app.utility import get_coord_neighbors
+
+DEFAULT_SIZES = [7, 11, 19, 25]
+DEFAULT_SNAKE_COUNTS = [1, 2, 4, 8]
+DEFAULT_TRAITS = ['', 'opp-agg-ins']
+
+# Short snakes are fresh from the start of a game, long ones are about twice the board's width
+LENGTHS = {
+    'short': lambda size: 3,
+    'long': lambda size: size * 2
+}
+
+# Moves each fresh process makes on each standard board size, when measuring startup
+STARTUP_MOVES = 20
+
+# A scenario is only flagged if its p95 move time grows by more than this fraction, and this many milliseconds
+DEFAULT_TOLERANCE = 0.2
+MIN_REGRESSION = 1.0
+
+
+def generate_move_request(rng, size, snake_count, length, food_count):
+    # type: (random.Random, int, int, int, int) -> dict
+    """
+    Generates a move request for a random board.
+    :param rng: Random number generator to build the board with.
+    :param size: Width and height of the board.
+    :param snake_count: Number of snakes on the board, the first one is us.
+    :param length: Length to grow each snake to, snakes that get boxed in end up shorter.
+    :param food_count: Number of food on the board.
+    :return: Move request data.
+    """
+    occupied = set()
+    snakes = []
+
+    for index in range(snake_count):
+        empty = [(x, y) for x in range(size) for y in range(size) if (x, y) not in occupied]
+
+        if not empty:
+            break
+
+        # Grow the snake back from its head, as a random walk that doesn't cross anything
+        body = [rng.choice(empty)]
+        occupied.add(body[0])
+
+        while len(body) < length:
+            neighbors = [coord for coord in get_coord_neighbors(body[-1])
+                         if 0 <= coord[0] < size and 0 <= coord[1] < size and coord not in occupied]
+
+            if not neighbors:
+                break
+
+            body.append(rng.choice(neighbors))
+            occupied.add(body[-1])
+
+        snakes.append({
+            'id': str(index),
+            'name': 'snake-%s' % index,
+            'health': rng.randint(1, 100),
+            'body': [{'x': x, 'y': y} for x, y in body]
+        })
+
+    empty = [(x, y) for x in range(size) for y in range(size) if (x, y) not in occupied]
+    food = rng.sample(empty, min(food_count, len(empty)))
+
+    return {
+        'game': {'id': 'benchmark'},
+        'turn': 1,
+        'board': {
+            'width': size,
+            'height': size,
+            'food': [{'x': x, 'y': y} for x, y in food],
+            'snakes': snakes
+        },
+        'you': snakes[0]
+    }
+
+
+def summarize(times):
+    return {
+        'count': len(times),
+        'p50': percentile(times, 0.5) * 1000,
+        'p95': percentile(times, 0.95) * 1000,
+        'p99': percentile(times, 0.99) * 1000
+    }
+
+
+def run(sizes=DEFAULT_SIZES, snake_counts=DEFAULT_SNAKE_COUNTS, traits_list=DEFAULT_TRAITS, boards=10, seed=0):
+    # type: (list, list, list, int, int) -> dict
+    """
+    Times Mover.next_move over generated boards of every combination of settings.
+    :return: Move time percentiles in milliseconds, by scenario and by the strategy that picked the move.
+    """
+    scenario_times = {}
+    branch_times = {}
+    all_times = []
+
+    for size in sizes:
+        for snake_count in snake_counts:
+            for length_name, length in sorted(LENGTHS.items()):
+                for traits in traits_list:
+                    scenario = '%sx%s/%s snakes/%s/%s' % (size, size, snake_count, length_name, traits or 'none')
+                    # Every scenario gets its own boards, which are the same from run to run
+                    rng = random.Random('%s-%s' % (seed, scenario))
+                    times = scenario_times[scenario] = []
+
+                    for _ in range(boards):
+                        data = generate_move_request(rng, size, snake_count, length(size), rng.randint(0, size))
+                        random.seed(rng.random())
+
+                        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                            started = time.time()
+                            mover = Mover(Context(data, '', traits))
+                            mover.next_move()
+                            elapsed = time.time() - started
+
+                        times.append(elapsed)
+                        all_times.append(elapsed)
+                        branch_times.setdefault(mover.motivation, []).append(elapsed)
+
+    return {
+        'settings': {
+            'sizes': sizes,
+            'snake_counts': snake_counts,
+            'traits': traits_list,
+            'boards': boards,
+            'seed': seed
+        },
+        'overall': summarize(all_times),
+        'scenarios': dict((scenario, summarize(times)) for scenario, times in scenario_times.items()),
+        'branches': dict((branch, summarize(times)) for branch, times in branch_times.items())
+    }
+
+
+def find_regressions(baseline, results, tolerance=DEFAULT_TOLERANCE):
+    # type: (dict, dict, float) -> list
+    """
+    Compares two benchmark results.
+    :return: (scenario, baseline p95, new p95) for every scenario whose p95 move time got worse.
+    """
+    regressions = []
+
+    for scenario, summary in sorted(results['scenarios'].items()):
+        baseline_summary = baseline['scenarios'].get(scenario)
+
+        if baseline_summary and summary['p95'] > baseline_summary['p95'] * (1 + tolerance) and \
+                summary['p95'] - baseline_summary['p95'] > MIN_REGRESSION:
+            regressions.append((scenario, baseline_summary['p95'], summary['p95']))
+
+    return regressions
+
+
+def probe_startup(preload):
+    """
+    Times the moves made by a freshly started process. This runs in its own process, started by measure_startup.
+    :param preload: Whether to warm up before the first move, as the servers do before forking workers.
+    """
+    if preload:
+        warm_up()
+
+    ready = time.time()
+    rng = random.Random(0)
+    times = {}
+
+    for size in STANDARD_SIZES:
+        times[size] = []
+
+        for _ in range(STARTUP_MOVES):
+            data = generate_move_request(rng, size, 4, 3, size // 2)
+
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                started = time.time()
+                Mover(Context(data, '', '')).next_move()
+                times[size].append(time.time() - started)
+
+    print(json.dumps({'ready': ready, 'times': times}))
+
+
+def measure_startup(preload):
+    # type: (bool) -> dict
+    """
+    Starts a new process, and times how long it takes to be ready for moves, and its first and later moves.
+    :param preload: Whether the process warms up before its first move.
+    :return: Startup time, and first move and later move p50 times by board size, in milliseconds.
+    """
+    started = time.time()
+    output = subprocess.check_output([sys.executable, '-m', 'app.benchmark', '--probe-startup'] +
+                                     (['--preload'] if preload else []))
+    probe = json.loads(output.decode('utf-8').splitlines()[-1])
+
+    return {
+        'startup': (probe['ready'] - started) * 1000,
+        'first_move': dict((size, times[0] * 1000) for size, times in probe['times'].items()),
+        'later_moves': dict((size, percentile(times[1:], 0.5) * 1000) for size, times in probe['times'].items())
+    }
+
+
+def measure_overhead(size=11, snake_count=4, repeats=2000, seed=0):
+    # type: (int, int, int, int) -> list
+    """
+    Times each step of a move request outside of Mover, with the old and new ways of decoding and responding.
+    :return: (step, microseconds per request) for each step.
+    """
+    data = generate_move_request(random.Random(seed), size, snake_count, size, size // 2)
+    body = json.dumps(data).encode('utf-8')
+
+    def request():
+        return bottle.BaseRequest({'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': 'application/json',
+                                   'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body)})
+
+    steps = [
+        ('decode with bottle.request.json', lambda: request().json),
+        ('decode with read_json (%s)' % loads.__module__, lambda: read_json(request())),
+        ('build context', lambda: Context(data, '', '')),
+        ('respond with json.dumps', lambda: bottle.HTTPResponse(
+            status=200, headers={'Content-Type': 'application/json'}, body=json.dumps({'move': 'up'}))),
+        ('respond with move_response', lambda: move_response('up'))
+    ]
+
+    return [(name, timeit.timeit(step, number=repeats) / repeats * 1000000) for name, step in steps]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark move times across board sizes and snake counts.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--snakes', type=int, nargs='+', default=DEFAULT_SNAKE_COUNTS)
+    parser.add_argument('--traits', nargs='+', default=DEFAULT_TRAITS, help='Trait strings to run, "" for none')
+    parser.add_argument('--boards', type=int, default=10, help='Boards to time for each scenario')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='benchmark.json', help='Where to save the results')
+    parser.add_argument('--compare', default=None, help='Earlier results to check for regressions against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--startup', action='store_true',
+                        help='Measure startup and first move times of new processes, with and without warming up')
+    parser.add_argument('--overhead', action='store_true', help='Time the work done for a move outside of Mover')
+    parser.add_argument('--probe-startup', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--preload', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe_startup:
+        probe_startup(args.preload)
+        return
+
+    if args.overhead:
+        for size in args.sizes:
+            for name, microseconds in measure_overhead(size, max(args.snakes)):
+                print('%-8s %-40s %8.1fus' % ('%sx%s' % (size, size), name, microseconds))
+        return
+
+    if args.startup:
+        for preload in [False, True]:
+            startup = measure_startup(preload)
+            print('%-12s ready in %7.1fms' % ('preloaded' if preload else 'cold', startup['startup']))
+
+            for size in sorted(startup['first_move'], key=int):
+                print('    %-8s first move %7.1fms, later moves p50 %7.1fms' % (
+                    '%sx%s' % (size, size), startup['first_move'][size], startup['later_moves'][size]))
+        return
+
+    results = run(args.sizes, args.snakes, args.traits, args.boards, args.seed)
+
+    with open(args.out, 'w') as out:
+        json.dump(results, out, indent=2, sort_keys=True)
+
+    for name, summary in [('overall', results['overall'])] + sorted(results['branches'].items()):
+        print('%-40s %5s moves  p50 %7.1fms  p95 %7.1fms  p99 %7.1fms' % (
+            name, summary['count'], summary['p50'], summary['p95'], summary['p99']))
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = find_regressions(json.load(baseline_file), results, args.tolerance)
+
+        for scenario, baseline_p95, p95 in regressions:
+            print('REGRESSION %s: p95 %.1fms -> %.1fms' % (scenario, baseline_p95, p95))
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
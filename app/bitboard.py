@@ -0,0 +1,102 @@
+from app.geometry import get_geometry
+
+# Masks are the same for every board of a given size, so they're built once and shared
+_masks = {}
+
+
+class BitMasks(object):
+    """
+    Precomputed masks for a board size, where each cell is one bit of an integer, at bit y * width + x.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.size = width * height
+
+        self.full = (1 << self.size) - 1
+        left_column = sum(1 << (y * width) for y in range(height))
+        right_column = left_column << (width - 1)
+
+        # Cells a shift left or right can't wrap into, from the other side of the row
+        self.not_left_column = self.full & ~left_column
+        self.not_right_column = self.full & ~right_column
+
+    def bit(self, coord):
+        return 1 << (coord[1] * self.width + coord[0])
+
+    def bits(self, coords):
+        bits = 0
+
+        for x, y in coords:
+            bits |= 1 << (y * self.width + x)
+
+        return bits
+
+    # Bits for every cell with a non-zero flag, from per-cell flags like the pathfinder's fatal mask
+    def from_flags(self, flags):
+        bits = 0
+
+        for index, flag in enumerate(flags):
+            if flag:
+                bits |= 1 << index
+
+        return bits
+
+    def coords(self, bits):
+        geometry = get_geometry(self.width, self.height)
+        coords = []
+
+        while bits:
+            lowest = bits & -bits
+            coords.append(geometry.coords[lowest.bit_length() - 1])
+            bits ^= lowest
+
+        return coords
+
+    # Every in bounds cell next to any of the cells
+    def neighbors(self, bits):
+        return (((bits << 1) & self.not_left_column) | ((bits >> 1) & self.not_right_column) |
+                ((bits << self.width) & self.full) | (bits >> self.width))
+
+    def is_adjacent_to_any(self, coord, bits):
+        return bool(self.neighbors(self.bit(coord)) & bits)
+
+    def flood_fill(self, start_bits, blocked=0, max_depth=None, max_size=None):
+        # type: (int, int, int, int) -> int
+        """
+        Fills out from the start cells a whole frontier at a time.
+        :param start_bits: Cells to start from.
+        :param blocked: Cells the fill can't go into.
+        :param max_depth: Most moves away from the start cells to fill, or None for no limit.
+        :param max_size: Cells to stop after filling at least, or None for no limit.
+        :return: Every cell that was filled, including the start cells.
+        """
+        open_bits = self.full & ~blocked
+        filled = start_bits
+        frontier = start_bits
+        depth = 0
+
+        while frontier and (max_depth is None or depth < max_depth):
+            frontier = self.neighbors(frontier) & open_bits & ~filled
+            filled |= frontier
+            depth += 1
+
+            if max_size is not None and count(filled) >= max_size:
+                break
+
+        return filled
+
+
+def get_masks(width, height):
+    masks = _masks.get((width, height))
+
+    if masks is None:
+        masks = _masks[(width, height)] = BitMasks(width, height)
+
+    return masks
+
+
+def count(bits):
+    return bin(bits).count('1')
+
@@ -13,6 +13,8 @@ AGGRESSIVE = 'agg'
 GLUTTONOUS = 'glu'
 INSECURE = 'ins'
 COOPERATIVE = 'coo'
+CALCULATING = 'cal'
+SPECULATIVE = 'spe'
 
 # DNA
 DEFAULT_DNA = [
@@ -1,19 +1,101 @@
+from contextlib import contextmanager
+
+from app import metrics
 from app.board import Board
-from app.snake import Snake
+from app.grid import OccupancyGrid
+from app.transposition import TranspositionTable, zobrist
 from app.constants import *
 
 
 class Context(object):
-    def __init__(self, data, dna, traits):
+    def __init__(self, data, dna, traits, games=None, shared=None):
         self.game_id = data['game']['id']
         self.turn = data['turn']
 
-        self.board = Board(data['board'])
-        self.me = Snake(data['you'])
+        # Another snake's context for the same game and turn can lend us its board, rather than parsing it again
+        self.board = shared.board if shared else Board(data['board'])
+        # We're one of the snakes on the board, so share that snake rather than keeping a separate copy
+        self.me = next(snake for snake in self.board.snakes if snake.id == data['you']['id'])
+
+        # Cell lookups for every snake on the board, shared by everything that plans this turn
+        # When we're keeping track of games, last turn's grid is moved along instead of being rebuilt
+        if shared:
+            self.grid = shared.grid
+        else:
+            self.grid = games.grid(data, self.board) if games is not None else OccupancyGrid(self.board)
+
+        # What we've seen each snake do earlier in the game, by snake id, if we're keeping track of games
+        if shared:
+            self.history = shared.history
+        else:
+            self.history = games.history(data) if games is not None else {}
+
+        # Results for positions we've already seen while working out this move
+        # Other snakes' contexts for the same turn are looking at the same positions, so they share it
+        self.table = shared.table if shared else TranspositionTable()
 
         # If no DNA is passed in, use the default values
         self.dna = [int(dna or DEFAULT_DNA[i]) for i, dna in enumerate(dna.split('-'))] if dna else DEFAULT_DNA
         self.traits = traits.split('-')
 
+        # Time by which we have to stop planning, or None for no limit
+        self.deadline = None
+
+        # Zobrist hash of the position, kept up to date as moves are applied and undone
+        self.hash = zobrist.hash_context(self)
+
     def enemy_snakes(self):
         return [snake for snake in self.board.snakes if snake.id != self.me.id]
+
+    @metrics.timed('context.apply_move')
+    def apply_move(self, snake, coord):
+        # type: (Snake, tuple) -> tuple
+        """
+        Moves a snake in place, eating any food at the coord.
+        :param snake: Snake to move.
+        :param coord: Coord the snake's head is moving into.
+        :return: Record used to undo the move.
+        """
+        food_index = self.board.food.index(coord) if coord in self.board.food else None
+        ate = food_index is not None
+
+        if ate:
+            self.board.food.pop(food_index)
+
+        # The old head and last step go, and the new head and first step come in
+        role = zobrist.role(self, snake)
+        hash_change = zobrist.head_key(role, snake) ^ (zobrist.key('food', coord) if ate else 0)
+        if snake.length > 1:
+            hash_change ^= zobrist.step_key(role, snake.body[-2], snake.tail)
+
+        snake_undo = snake.moved(coord, ate)
+        grid_undo = self.grid.move_snake(self.grid.numbers[snake.id], coord, snake_undo[0], ate)
+
+        hash_change ^= zobrist.head_key(role, snake)
+        if snake.length > 1:
+            hash_change ^= zobrist.step_key(role, coord, snake.body[1])
+
+        self.hash ^= hash_change
+
+        return snake, coord, food_index, snake_undo, grid_undo, hash_change
+
+    def undo_move(self, undo):
+        snake, coord, food_index, snake_undo, grid_undo, hash_change = undo
+
+        self.hash ^= hash_change
+        self.grid.undo_move(grid_undo)
+        snake.unmoved(snake_undo)
+
+        if food_index is not None:
+            self.board.food.insert(food_index, coord)
+
+    # Temporarily moves a snake (us, by default), for looking at what the board would be like
+    @contextmanager
+    def moved(self, coord, snake=None):
+        undo = self.apply_move(snake or self.me, coord)
+
+        try:
+            yield self
+        finally:
+            self.undo_move(undo)
+
@@ -0,0 +1,143 @@
+import time
+
+from app.grid import OccupancyGrid
+from app.opponents import observe_moves
+
+# How long to hang on to a game we haven't heard about, in seconds
+GAME_TTL = 600
+
+
+class GameState(object):
+    """
+    What we remember about a game between turns.
+    """
+
+    def __init__(self):
+        self.turn = None
+        self.grid = None
+        self.bodies = {}  # Every snake's body on the last turn, by snake id
+        self.food = []  # Food on the last turn
+        self.history = {}  # What we've seen every snake do this game, by snake id
+        self.last_seen = time.time()
+
+
+class GameCache(object):
+    """
+    Per-process cache of the games we're playing, keyed by game id and our snake id,
+    so each turn can build on the last one instead of starting from scratch.
+    """
+
+    def __init__(self, ttl=GAME_TTL):
+        self.ttl = ttl
+        self._games = {}
+
+    def __len__(self):
+        return len(self._games)
+
+    # Starts and ends always get a response, so ones that don't say which game and snake they're for are skipped
+    def start(self, data):
+        self._evict_expired()
+
+        if self._has_key(data):
+            self._games[self._key(data)] = GameState()
+
+    def end(self, data):
+        if self._has_key(data):
+            self._games.pop(self._key(data), None)
+
+    def get(self, data):
+        # type: (dict) -> GameState
+        """
+        Gets the state for a game, starting a new one if we missed the start of the game.
+        :param data: Request data.
+        :return: Game state.
+        """
+        key = self._key(data)
+
+        if key not in self._games:
+            self.start(data)
+
+        state = self._games[key]
+        state.last_seen = time.time()
+
+        return state
+
+    def grid(self, data, board):
+        # type: (dict, Board) -> OccupancyGrid
+        """
+        Gets the occupancy grid for this turn, moving last turn's grid along when we can.
+        :param data: Request data.
+        :param board: This turn's board.
+        :return: Occupancy grid for the board.
+        """
+        state = self.get(data)
+
+        if state.turn == data['turn'] - 1:
+            observe_moves(state.history, state.bodies, state.food, board)
+
+        if state.grid is None or state.turn != data['turn'] - 1 or not self._update_grid(state, board):
+            state.grid = OccupancyGrid(board)
+
+        state.turn = data['turn']
+        state.bodies = dict((snake.id, list(snake.body)) for snake in board.snakes)
+        state.food = list(board.food)
+
+        return state.grid
+
+    # What we've seen every snake do in a game, by snake id
+    def history(self, data):
+        return self.get(data).history
+
+    # Moves every snake along in last turn's grid, as long as they all made a single move
+    def _update_grid(self, state, board):
+        grid = state.grid
+        moves = []
+
+        if (grid.width, grid.height) != (board.width, board.height):
+            return False
+
+        for snake in board.snakes:
+            previous_body = state.bodies.get(snake.id)
+
+            if previous_body is None or snake.id not in grid.numbers:
+                return False
+
+            body = list(snake.body)
+            moved_body = [snake.head] + previous_body[:-1]
+
+            if body == moved_body:
+                moves.append((grid.numbers[snake.id], snake.head, previous_body[-1], False))
+            elif body == moved_body + moved_body[-1:]:
+                moves.append((grid.numbers[snake.id], snake.head, previous_body[-1], True))
+            else:
+                return False
+
+        # Snakes that have died since last turn
+        living_ids = set(snake.id for snake in board.snakes)
+        for snake_id, previous_body in state.bodies.items():
+            if snake_id not in living_ids:
+                grid.remove_snake(grid.numbers[snake_id], previous_body)
+
+        for move in moves:
+            grid.move_snake(*move)
+
+        return True
+
+    def _evict_expired(self):
+        expired = time.time() - self.ttl
+
+        for key in [key for key, state in self._games.items() if state.last_seen < expired]:
+            del self._games[key]
+
+    @staticmethod
+    def _has_key(data):
+        return isinstance(data, dict) and isinstance(data.get('game'), dict) and isinstance(data.get('you'), dict) \
+            and 'id' in data['game'] and 'id' in data['you']
+
+    @staticmethod
+    def _key(data):
+        return data['game']['id'], data['you']['id']
+
+
+# Shared by every request this process handles
+games = GameCache()
@@ -0,0 +1,75 @@
+from array import array
+
+from app.constants import DIRECTION_MAP
+
+# Geometry tables are the same for every board of a given size, so they're built once and shared
+_geometries = {}
+
+# Board sizes most games are played on, whose tables are worth building before any requests come in
+STANDARD_SIZES = [7, 11, 19]
+
+
+class Geometry(object):
+    """
+    Lookup tables for a board size, with cells as flat indexes (y * width + x).
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.size = width * height
+
+        self.coords = [(index % width, index // width) for index in range(self.size)]
+        self.xs = [x for x, y in self.coords]
+        self.ys = [y for x, y in self.coords]
+
+        # In bounds neighbors of each cell, in up, down, left, right order
+        self.neighbors = [tuple(self.index((x + dx, y + dy)) for dx, dy in DIRECTION_MAP
+                                if 0 <= x + dx < width and 0 <= y + dy < height)
+                          for x, y in self.coords]
+        self.neighbor_coords = [tuple(self.coords[neighbor] for neighbor in neighbors) for neighbors in self.neighbors]
+
+        # Direction to move from each cell into each of its neighbors, by (cell, neighbor)
+        self.directions = dict(((index, self.index((x + dx, y + dy))), direction)
+                               for index, (x, y) in enumerate(self.coords)
+                               for (dx, dy), direction in DIRECTION_MAP.items()
+                               if 0 <= x + dx < width and 0 <= y + dy < height)
+
+        # Distances from each cell to every other cell, built the first time they're needed
+        self._distances = [None] * self.size
+
+    def index(self, coord):
+        return coord[1] * self.width + coord[0]
+
+    def in_bounds(self, coord):
+        return 0 <= coord[0] < self.width and 0 <= coord[1] < self.height
+
+    def distances(self, index):
+        row = self._distances[index]
+
+        if row is None:
+            x = self.xs[index]
+            y = self.ys[index]
+            row = self._distances[index] = array('H', [abs(x - other_x) + abs(y - other_y)
+                                                       for other_x, other_y in self.coords])
+
+        return row
+
+    def distance(self, index1, index2):
+        return self.distances(index1)[index2]
+
+    # Direction to move from a coord into a neighboring coord, or None if they aren't neighbors
+    def direction(self, coord1, coord2):
+        if not (self.in_bounds(coord1) and self.in_bounds(coord2)):
+            return None
+
+        return self.directions.get((self.index(coord1), self.index(coord2)))
+
+
+def get_geometry(width, height):
+    geometry = _geometries.get((width, height))
+
+    if geometry is None:
+        geometry = _geometries[(width, height)] = Geometry(width, height)
+
+    return geometry
@@ -0,0 +1,116 @@
+from array import array
+
+from app.geometry import get_geometry
+
+
+class OccupancyGrid(object):
+    """
+    Flat per-cell view of the snakes on the board, indexed by y * width + x.
+
+    For every occupied cell we keep which snake is there (1-based, 0 is empty) and when
+    that segment was laid down, counting the snake's moves. Together with each snake's
+    latest head and length, that tells us how many moves ago a segment was the head (its age),
+    and how many turns it will be until the cell is vacated (1 for the tail, the snake's length
+    for the head), while letting a snake move by only touching its head and tail cells.
+    """
+
+    def __init__(self, board):
+        self.width = board.width
+        self.height = board.height
+        self.geometry = get_geometry(self.width, self.height)
+
+        size = self.width * self.height
+        self.occupant = bytearray(size)
+        self.laid = array('l', [0]) * size
+
+        # Per snake values, by snake number
+        self.numbers = {}
+        self.head_stamps = [0]
+        self.lengths = [0]
+
+        for number, snake in enumerate(board.snakes, 1):
+            self.numbers[snake.id] = number
+            self.head_stamps.append(0)
+            self.lengths.append(0)
+            self.add_snake(number, snake)
+
+    def index(self, coord):
+        return coord[1] * self.width + coord[0]
+
+    def coord(self, index):
+        return index % self.width, index // self.width
+
+    def in_bounds(self, coord):
+        return 0 <= coord[0] < self.width and 0 <= coord[1] < self.height
+
+    def add_snake(self, number, snake):
+        length = len(snake.body)
+        self.head_stamps[number] = length - 1
+        self.lengths[number] = length
+
+        # Walk from the tail, so that stacked segments keep the values of the segment nearest the head
+        for age in range(length - 1, -1, -1):
+            index = self.index(snake.body[age])
+            self.occupant[index] = number
+            self.laid[index] = length - 1 - age
+
+    def remove_snake(self, number, body):
+        for coord in body:
+            index = self.index(coord)
+
+            # Leave cells alone if another snake has moved into them
+            if self.occupant[index] == number:
+                self.occupant[index] = 0
+
+    def move_snake(self, number, head, tail, ate=False):
+        # type: (int, tuple, tuple, bool) -> tuple
+        """
+        Moves a snake's head into a cell, and its tail off the end of its body.
+        :param number: Number of the snake that's moving.
+        :param head: Coord of the snake's new head.
+        :param tail: Coord of the tail segment the snake left behind.
+        :param ate: Whether the snake ate, and so grew.
+        :return: Record used to undo the move.
+        """
+        head_index = self.index(head)
+        tail_index = self.index(tail)
+
+        # Stacked tails only free up the cell when their last segment leaves
+        tail_stamp = self.head_stamps[number] - self.lengths[number] + 1
+        tail_cleared = self.occupant[tail_index] == number and self.laid[tail_index] == tail_stamp
+
+        if tail_cleared:
+            self.occupant[tail_index] = 0
+
+        undo = (number, head_index, self.occupant[head_index], self.laid[head_index], tail_index, tail_cleared, ate)
+
+        self.head_stamps[number] += 1
+        self.occupant[head_index] = number
+        self.laid[head_index] = self.head_stamps[number]
+
+        if ate:
+            self.lengths[number] += 1
+
+        return undo
+
+    def undo_move(self, undo):
+        number, head_index, occupant, laid, tail_index, tail_cleared, ate = undo
+
+        if ate:
+            self.lengths[number] -= 1
+
+        self.occupant[head_index] = occupant
+        self.laid[head_index] = laid
+        self.head_stamps[number] -= 1
+
+        if tail_cleared:
+            self.occupant[tail_index] = number
+            self.laid[tail_index] = self.head_stamps[number] - self.lengths[number] + 1
+
+    def is_occupied(self, coord):
+        return self.occupant[self.index(coord)] != 0
+
+    # Number of turns until a cell is free to move into (0 if it's already empty)
+    def vacates_at(self, index):
+        number = self.occupant[index]
+        return self.lengths[number] - self.head_stamps[number] + self.laid[index] if number else 0
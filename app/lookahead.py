@@ -0,0 +1,248 @@
+import time
+from itertools import islice, product
+
+from app import metrics
+from app.constants import *
+from app.opponents import OpponentModel
+from app.pathfinder import PathFinder
+from app.search import DeadlineExceeded
+
+# How long we're willing to spend searching, in seconds
+DEFAULT_TIME_BUDGET = 0.2
+
+# Deepest we'll search, in turns, even if there's time left
+MAX_DEPTH = 8
+
+# Only the closest few enemies near our head are worth looking ahead for,
+# since every extra snake multiplies the moves to search
+MAX_ENEMIES = 2
+ENEMY_RADIUS = 6
+
+# Enemy moves less likely than this aren't searched on the first turn, where we can predict them
+MIN_REPLY_CHANCE = 0.05
+
+# Score for a position where we're dead, before adjusting for how long we survived
+LOSS = -1000000000.0
+
+# Score for each enemy we kill with a head on collision
+KILL_BONUS = 10000
+
+
+class OutOfTime(Exception):
+    pass
+
+
+class Lookahead(object):
+    """
+    Looks a few turns ahead, searching our moves against every combination of moves by the enemies near us.
+    Enemies are assumed to pick whatever is worst for us (paranoid search), and searching deepens
+    one turn at a time until we run out of time. On the first turn, enemies only make the moves
+    they're likely to, most likely first.
+    """
+
+    def __init__(self, context, time_budget=DEFAULT_TIME_BUDGET):
+        self.context = context
+        self.time_budget = time_budget
+
+        self.depth = 0
+        self.nodes = 0
+        self._deadline = None
+        self._first_replies = None
+
+        me = self.context.me
+        geometry = self.context.grid.geometry
+        enemies = sorted((geometry.distance(geometry.index(me.head), geometry.index(snake.head)), index, snake)
+                         for index, snake in enumerate(self.context.enemy_snakes()))
+        self.enemies = [snake for distance, index, snake in enemies if distance <= ENEMY_RADIUS][:MAX_ENEMIES]
+
+    def best_move(self):
+        # type: () -> tuple
+        """
+        Searches as deep as we can in the time budget.
+        :return: Tuple of the best move's score and coord, or None if we have no moves or ran out of time.
+        """
+        self._deadline = time.time() + self.time_budget
+
+        # Don't search past the deadline for the whole move
+        if self.context.deadline is not None:
+            self._deadline = min(self._deadline, self.context.deadline)
+
+        moves = self._moves(self.context.me)
+
+        if not moves:
+            return None
+
+        opponents = OpponentModel(self.context)
+        self._first_replies = list(product(*[[coord for chance, coord in opponents.move_chances(snake)
+                                              if chance >= MIN_REPLY_CHANCE] or [None]
+                                             for snake in self.enemies]))
+
+        best = None
+
+        try:
+            for depth in range(1, MAX_DEPTH + 1):
+                best = self._search_root(moves, depth)
+                self.depth = depth
+
+                # Try the best move first next time, so we can prune more of the others
+                moves.remove(best[1])
+                moves.insert(0, best[1])
+        except (OutOfTime, DeadlineExceeded):
+            pass
+
+        return best
+
+    def _search_root(self, moves, depth):
+        best = None
+
+        for move in moves:
+            score = self._enemy_replies(move, depth, best[0] if best else LOSS * 2, self._first_replies)
+
+            if best is None or score > best[0]:
+                best = (score, move)
+
+        return best
+
+    # Our score for a move, assuming enemies choose the moves that are worst for us
+    # out of the given replies, or any of their moves
+    def _enemy_replies(self, move, depth, alpha, all_replies=None):
+        worst = None
+
+        if all_replies is None:
+            all_replies = product(*[self._moves(snake) or [None] for snake in self.enemies])
+
+        for replies in all_replies:
+            score = self._play(move, replies, depth)
+
+            if worst is None or score < worst:
+                worst = score
+
+            # We already have a better move than this one
+            if worst <= alpha:
+                break
+
+        return worst
+
+    def _best_reply(self, depth):
+        moves = self._moves(self.context.me)
+
+        if not moves:
+            return self._loss(depth)
+
+        best = None
+
+        for move in moves:
+            score = self._enemy_replies(move, depth, best if best is not None else LOSS * 2)
+
+            if best is None or score > best:
+                best = score
+
+        return best
+
+    # Play a turn of moves, then score what's left
+    def _play(self, move, replies, depth):
+        self.nodes += 1
+
+        if time.time() > self._deadline:
+            raise OutOfTime()
+
+        me = self.context.me
+        moves = [(me, move)] + [(snake, coord) for snake, coord in zip(self.enemies, replies) if coord]
+
+        undo = [self.context.apply_move(snake, coord) for snake, coord in moves]
+
+        try:
+            if self._is_dead():
+                return self._loss(depth)
+
+            kills = len([snake for snake in self.enemies if snake.head == me.head])
+
+            if depth == 1:
+                score = self.evaluate()
+            else:
+                score = self._best_reply(depth - 1)
+
+            return score + kills * KILL_BONUS
+        finally:
+            for snake_undo in reversed(undo):
+                self.context.undo_move(snake_undo)
+
+    @metrics.timed('lookahead.evaluate')
+    def evaluate(self):
+        """
+        Scores the current position for us, with the same heuristics as PathFinder uses to plan paths.
+        :return: Score, higher is better.
+        """
+        me = self.context.me
+        dna = self.context.dna
+        pathfinder = PathFinder(self.context)
+
+        # Evaluations only depend on health for whether we're hungry
+        key = ('evaluate', pathfinder.state_hash(), me.health < dna[PECKISH_THRESHOLD], tuple(dna))
+        score = self.context.table.get(key)
+
+        if score is None:
+            score = self._evaluate(pathfinder)
+            self.context.table.put(key, score)
+
+        return score
+
+    def _evaluate(self, pathfinder):
+        me = self.context.me
+        dna = self.context.dna
+        geometry = self.context.grid.geometry
+
+        # Less room to move is worse, and no room at all is as good as dead
+        fill_size = max(pathfinder.coord_to_fill_size().values() or [0])
+
+        if not fill_size:
+            return self._loss(0)
+
+        score = -dna[TRAP_DANGER_COST] / float(fill_size)
+
+        # The more of the board we can get to before anyone else, the better
+        score += pathfinder.territory().size(me)
+
+        # Being near enemy heads is dangerous
+        score -= sum(1 / float(danger or 1) for coord, danger in pathfinder.head_danger_fill()
+                     if coord == me.head) * dna[HEAD_DANGER_COST]
+
+        # Being far away from food is bad when we're hungry
+        if me.health < dna[PECKISH_THRESHOLD] and self.context.board.food:
+            head = geometry.index(me.head)
+            score -= min(geometry.distance(head, geometry.index(food))
+                         for food in self.context.board.food) * dna[BASE_COST]
+
+        return score
+
+    # Later deaths are better than earlier ones, since something might go our way in the meantime
+    def _loss(self, depth):
+        return LOSS - depth
+
+    def _is_dead(self):
+        me = self.context.me
+
+        if me.health <= 0 or not self.context.grid.in_bounds(me.head):
+            return True
+
+        for snake in self.context.board.snakes:
+            # Running into any snake's body
+            if me.head in islice(snake.body, 1, None):
+                return True
+
+            # Losing a head on collision
+            if snake is not me and snake.head == me.head and snake.length >= me.length:
+                return True
+
+        return False
+
+    # Moves a snake could make without running into a wall or body, where tails will have moved on
+    def _moves(self, snake):
+        grid = self.context.grid
+        geometry = grid.geometry
+
+        if not grid.in_bounds(snake.head):
+            return []
+
+        return [geometry.coords[neighbor] for neighbor in geometry.neighbors[geometry.index(snake.head)]
+                if not grid.occupant[neighbor] or grid.vacates_at(neighbor) == 1]
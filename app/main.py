@@ -1,12 +1,33 @@
+import contextlib
+import gc
 import os
 import random
+import time
 
 import bottle
 
+from app import metrics
 from app.api import *
+from app.batch import move_batch, read_batch
 from app.context import Context
+from app.games import games
+from app.geometry import STANDARD_SIZES, get_geometry
 from app.mover import Mover
 
+# How long the game engine waits for our move, in milliseconds, if the request doesn't say
+DEFAULT_MOVE_TIMEOUT = int(os.getenv('MOVE_TIMEOUT', 500))
+
+# Time to leave for our response to get back to the game engine, in milliseconds
+RESPONSE_MARGIN = int(os.getenv('RESPONSE_MARGIN', 150))
+
+# Company pride
+S4_COLORS = {
+    'indigo': '#4E54A4',
+    'green': '#44B5AD',
+    'orange': '#F37970',
+    'purple': '#AA66AA'
+}
+
 
 @bottle.route('/')
 @bottle.route('/<traits>/')
@@ -46,16 +67,10 @@ def ping(dna='', traits=''):
 @bottle.post('/<traits>/start')
 @bottle.post('/<dna>/<traits>/start')
 def start(dna='', traits=''):
-    # Company pride
-    s4_colors = {
-        'indigo': '#4E54A4',
-        'green': '#44B5AD',
-        'orange': '#F37970',
-        'purple': '#AA66AA'
-    }
+    games.start(read_optional_json(bottle.request))
 
     # Make us pretty!
-    color = random.choice(list(s4_colors.values()))
+    color = random.choice(list(S4_COLORS.values()))
 
     return start_response(color)
 
@@ -64,30 +79,101 @@ def start(dna='', traits=''):
 @bottle.post('/<traits>/move')
 @bottle.post('/<dna>/<traits>/move')
 def move(dna='', traits=''):
-    data = bottle.request.json
+    received = time.time()
+    data = read_json(bottle.request)
 
-    context = Context(data, dna, traits)
+    context = Context(data, dna, traits, games)
     mover = Mover(context)
-    move_direction = mover.next_move()
+    move_direction = mover.next_move(received + move_time_budget(data))
 
     return move_response(move_direction)
 
 
+@bottle.post('/batch')
+@bottle.post('/<traits>/batch')
+@bottle.post('/<dna>/<traits>/batch')
+def batch(dna='', traits=''):
+    """
+    Works out moves for a list of move requests at once, across a pool of processes.
+    Each request can have its own "dna" and "traits", otherwise they're taken from the URL.
+    """
+    received = time.time()
+    requests = read_batch(read_json(bottle.request), dna, traits)
+    deadline = received + min(move_time_budget(data) for _, _, data in requests) if requests else None
+
+    return batch_response(move_batch(requests, deadline))
+
+
+# How long we have to work out a move, in seconds
+def move_time_budget(data):
+    timeout = data.get('game', {}).get('timeout') or DEFAULT_MOVE_TIMEOUT
+
+    return max(timeout - RESPONSE_MARGIN, 0) / 1000.0
+
+
 @bottle.post('/end')
 @bottle.post('/<traits>/end')
 @bottle.post('/<dna>/<traits>/end')
 def end(dna='', traits=''):
+    games.end(read_optional_json(bottle.request))
+
     return end_response()
 
 
+@bottle.get('/metrics')
+@bottle.get('/<traits>/metrics')
+@bottle.get('/<dna>/<traits>/metrics')
+def get_metrics(dna='', traits=''):
+    """
+    Cumulative timings of the hot paths for every move this process has made,
+    when the server is started with METRICS=1.
+    """
+    return metrics_response(metrics.exposition())
+
+
+def warm_up(sizes=STANDARD_SIZES):
+    """
+    Builds the lookup tables for the standard board sizes and makes a move on each of them,
+    so the first real move doesn't pay for anything that's built lazily.
+    Run before forking workers, so they all start out with it already built.
+    """
+    for size in sizes:
+        get_geometry(size, size)
+
+        you = {'id': 'warm-up', 'name': 'warm-up', 'health': 100, 'body': [{'x': size // 2, 'y': size // 2}] * 3}
+        data = {
+            'game': {'id': 'warm-up'},
+            'turn': 0,
+            'board': {'width': size, 'height': size, 'food': [{'x': 0, 'y': 0}], 'snakes': [you]},
+            'you': you
+        }
+
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            Mover(Context(data, '', '')).next_move()
+
+    # On Python 3.7 and up, keep the garbage collector from touching everything built so far,
+    # so forked workers copy fewer of the pages it's on. Older versions don't have this, and
+    # reference counting copies pages as they're used anyway, so workers only save the time to build it
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+
 # Expose WSGI app (so gunicorn can find it)
 application = bottle.default_app()
 
 
 if __name__ == '__main__':
-    bottle.run(
-        application,
-        host=os.getenv('IP', '0.0.0.0'),
-        port=os.getenv('PORT', '8080'),
-        debug=os.getenv('DEBUG', True)
-    )
+    # The same routes can be served by an asyncio server that works out moves in a pool of processes
+    if os.getenv('SERVER') == 'async':
+        from app.server import run
+        run(os.getenv('IP', '0.0.0.0'), int(os.getenv('PORT', '8080')))
+    else:
+        if os.getenv('PRELOAD'):
+            warm_up()
+
+        bottle.run(
+            application,
+            host=os.getenv('IP', '0.0.0.0'),
+            port=os.getenv('PORT', '8080'),
+            debug=os.getenv('DEBUG', True)
+        )
@@ -0,0 +1,141 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Metrics are off unless the METRICS environment variable is set, and cost nothing when they're off,
+# since instrumented functions are left as they are
+ENABLED = os.getenv('METRICS', '').lower() not in ('', '0', 'false', 'no')
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 5, 10, 50, 100, 250, 500, float('inf')]
+
+# Timings for the turn being worked out, by name, as [calls, seconds]
+_turn = {}
+
+# Timings for every turn this process has worked out, by name, as [bucket counts, calls, seconds]
+_histograms = {}
+
+
+def timed(name):
+    """
+    Decorator that records how long each call to a function takes, when metrics are enabled.
+    :param name: Name to record the timings under.
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.time()
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.time() - started)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def timer(name):
+    started = time.time()
+
+    try:
+        yield
+    finally:
+        if ENABLED:
+            record(name, time.time() - started)
+
+
+def record(name, seconds):
+    turn = _turn.setdefault(name, [0, 0.0])
+    turn[0] += 1
+    turn[1] += seconds
+
+    histogram = _histograms.get(name)
+
+    if histogram is None:
+        histogram = _histograms[name] = [[0] * len(BUCKETS), 0, 0.0]
+
+    milliseconds = seconds * 1000
+    histogram[0][next(index for index, bound in enumerate(BUCKETS) if milliseconds <= bound)] += 1
+    histogram[1] += 1
+    histogram[2] += seconds
+
+
+def start_turn():
+    _turn.clear()
+
+
+def end_turn(context):
+    """
+    Logs the timings for the turn as a line of JSON.
+    :param context: Context for the turn.
+    """
+    if not ENABLED:
+        return
+
+    print(json.dumps({
+        'metrics': 'turn',
+        'game': context.game_id,
+        'turn': context.turn,
+        'board': '%sx%s' % (context.board.width, context.board.height),
+        'snakes': len(context.board.snakes),
+        'timings': dict((name, {'calls': calls, 'ms': round(seconds * 1000, 3)})
+                        for name, (calls, seconds) in sorted(_turn.items()))
+    }, sort_keys=True))
+
+
+def snapshot():
+    # type: () -> dict
+    """
+    Copy of the cumulative timings for every turn so far, which can be sent to another process.
+    :return: [bucket counts, calls, seconds] by name.
+    """
+    return dict((name, [list(buckets), calls, seconds]) for name, (buckets, calls, seconds) in _histograms.items())
+
+
+def merge(*snapshots):
+    # type: (*dict) -> dict
+    """
+    Adds up the timings from several processes.
+    :return: [bucket counts, calls, seconds] by name.
+    """
+    merged = {}
+
+    for histograms in snapshots:
+        for name, (buckets, calls, seconds) in histograms.items():
+            total = merged.setdefault(name, [[0] * len(BUCKETS), 0, 0.0])
+            total[0] = [count + added for count, added in zip(total[0], buckets)]
+            total[1] += calls
+            total[2] += seconds
+
+    return merged
+
+
+def exposition(histograms=None):
+    # type: (dict) -> str
+    """
+    Cumulative timings for every turn so far, in the Prometheus text format.
+    :param histograms: Timings to show, defaults to this process's.
+    :return: Metrics text.
+    """
+    lines = ['# TYPE snake_timing_seconds histogram']
+
+    for name, (buckets, calls, seconds) in sorted((_histograms if histograms is None else histograms).items()):
+        cumulative = 0
+
+        for bound, count in zip(BUCKETS, buckets):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound / 1000.0)
+            lines.append('snake_timing_seconds_bucket{name="%s",le="%s"} %s' % (name, le, cumulative))
+
+        lines.append('snake_timing_seconds_count{name="%s"} %s' % (name, calls))
+        lines.append('snake_timing_seconds_sum{name="%s"} %r' % (name, seconds))
+
+    return '\n'.join(lines) + '\n'
@@ -1,9 +1,13 @@
 import random
-from copy import deepcopy
+import time
 
+from app import metrics
 from app.constants import *
+from app.lookahead import Lookahead
 from app.pathfinder import PathFinder
-from app.utility import get_coord_neighbors, sub_coords
+from app.rollout import RolloutSelector, get_pool
+from app.search import DeadlineExceeded
+from app.utility import get_coord_neighbors
 
 
 class Mover(object):
@@ -14,60 +18,89 @@ class Mover(object):
         self._best_path_to_food = []
         self._best_path_to_my_tail = []
 
-    def next_move(self):
+        self.motivation = ""  # Why we chose the last move, for logging and benchmarks
+
+        # Transposition table counts when we started, so we can log how it did for this move
+        self._table_hits = context.table.hits
+        self._table_misses = context.table.misses
+
+    def next_move(self, deadline=None):
         next_path = []
         motivation = ""
+        out_of_time = False
 
-        # We're trapped, we need to find a new approach
-        if self.pathfinder.is_trapped():
-            motivation = "Is Trapped"
-            # Try and follow our tail to get out
-            next_path = self.best_path_to_my_tail()
-
-            # Ok, try and find a way to the square closest to our tail
-            if not next_path:
-                next_path = self._get_path_to_body_segment_closest_to_tail([self.context.me])
-
-            # Ok, anyone's closest tail square will do
-            if not next_path:
-                next_path = self._get_path_to_body_segment_closest_to_tail(self.context.enemy_snakes())
-
-        # Eat if we're starving
-        if self.context.me.health < self.context.dna[STARVING_THRESHOLD]:
-            motivation = "Starving"
-            next_path = self.best_path_to_food()
-        # Eat if opportunistic or peckish
-        elif OPPORTUNISTIC in self.context.traits or self.context.me.health < self.context.dna[PECKISH_THRESHOLD]:
-            motivation = "Opportunistic or Peckish"
-            # Are we adjacent to the food?
-            # Will eating the food put us in a smaller space?
-            if self.best_path_to_food() and len(self.best_path_to_food()[1]) <= 2:
-                # and (not next_path or self.best_path_to_food()[0] <= next_path[0]):
-                move = self.best_path_to_food()[1][1]
-                move_pathfinder = self._get_pathfinder_for_move(move)
-
-                # Will we still be able to get where we were going?
-                if not next_path or move_pathfinder.get_path_to_coord(move, next_path[1][-1]):
-                    # self.best_path_to_food()[0] <= self.context.dna[MAX_OPPORTUNISTIC_EAT_COST] or
-                    # self.pathfinder.path_is_safe(self.best_path_to_food())
-                    next_path = self.best_path_to_food()
+        started = time.time()
+        metrics.start_turn()
+
+        # Work out the safest moves up front, so we always have something to fall back on
+        with metrics.timer('mover.safest_moves'):
+            safest_moves = self._get_safest_moves()
+
+        # Everything past here is more expensive, and has to give up if we run out of time
+        self.context.deadline = deadline
+
+        try:
+            # We're trapped, we need to find a new approach
+            if self.pathfinder.is_trapped():
+                motivation = "Is Trapped"
+                # Try and follow our tail to get out
+                next_path = self.best_path_to_my_tail()
+
+                # Ok, try and find a way to the square closest to our tail
+                if not next_path:
+                    next_path = self._get_path_to_body_segment_closest_to_tail([self.context.me])
 
-        # Try and get longer
-        if not next_path and GLUTTONOUS in self.context.traits and \
-                not self.context.board.is_longest_snake(self.context.me):
-            motivation = "Gluttonous"
-            if self.best_path_to_food() and self.pathfinder.path_is_safe(self.best_path_to_food()):
+                # Ok, anyone's closest tail square will do
+                if not next_path:
+                    next_path = self._get_path_to_body_segment_closest_to_tail(self.context.enemy_snakes())
+
+            # Eat if we're starving
+            if self.context.me.health < self.context.dna[STARVING_THRESHOLD]:
+                motivation = "Starving"
                 next_path = self.best_path_to_food()
+            # Eat if opportunistic or peckish
+            elif OPPORTUNISTIC in self.context.traits or self.context.me.health < self.context.dna[PECKISH_THRESHOLD]:
+                motivation = "Opportunistic or Peckish"
+                # Are we adjacent to the food?
+                # Will eating the food put us in a smaller space?
+                if self.best_path_to_food() and len(self.best_path_to_food()[1]) <= 2:
+                    # and (not next_path or self.best_path_to_food()[0] <= next_path[0]):
+                    move = self.best_path_to_food()[1][1]
+
+                    # Will we still be able to get where we were going?
+                    if not next_path or self._can_reach_after_move(move, next_path[1][-1]):
+                        # self.best_path_to_food()[0] <= self.context.dna[MAX_OPPORTUNISTIC_EAT_COST] or
+                        # self.pathfinder.path_is_safe(self.best_path_to_food())
+                        next_path = self.best_path_to_food()
+
+            # Try and get longer
+            if not next_path and GLUTTONOUS in self.context.traits and \
+                    not self.context.board.is_longest_snake(self.context.me):
+                motivation = "Gluttonous"
+                if self.best_path_to_food() and self.pathfinder.path_is_safe(self.best_path_to_food()):
+                    next_path = self.best_path_to_food()
+
+            # Think a few turns ahead about what the snakes around us might do
+            if not next_path and CALCULATING in self.context.traits:
+                motivation = "Calculating"
+                next_path = self._get_lookahead_path()
 
-        # The big snakes eat the little ones
-        if not next_path and AGGRESSIVE in self.context.traits:
-            motivation = "Aggressive"
-            next_path = self._get_best_attack_path()
+            # Play out lots of quick games from each of our moves, and go with the one we do best in
+            if not next_path and SPECULATIVE in self.context.traits:
+                motivation = "Speculative"
+                next_path = self._get_rollout_path()
 
-        # Try and chase tail
-        if not next_path and INSECURE in self.context.traits:
-            motivation = "Insecure"
-            next_path = self.best_path_to_my_tail()
+            # The big snakes eat the little ones
+            if not next_path and AGGRESSIVE in self.context.traits:
+                motivation = "Aggressive"
+                next_path = self._get_best_attack_path()
+
+            # Try and chase tail
+            if not next_path and INSECURE in self.context.traits:
+                motivation = "Insecure"
+                next_path = self.best_path_to_my_tail()
+        except DeadlineExceeded:
+            out_of_time = True
 
         # Next move is second coord in path (the first coord is our current position)
         next_coord = next_path[1][1] if next_path else None
@@ -75,24 +108,39 @@ class Mover(object):
         # Move to the safest adjacent square
         if not next_coord:
             motivation = "Random"
-            next_coord = random.choice(self._get_safest_moves())
-
-        # Calculate to the change between our head and the next move
-        coord_delta = sub_coords(next_coord, self.context.me.head) if next_coord else None
+            next_coord = random.choice(safest_moves)
 
         # Look up the name of the direction we're trying to move, or move randomly, if we're going to die
-        direction = DIRECTION_MAP[coord_delta] if coord_delta else random.choice(list(DIRECTION_MAP.values()))
+        direction = self.context.grid.geometry.direction(self.context.me.head, next_coord) if next_coord \
+            else random.choice(list(DIRECTION_MAP.values()))
+
+        if out_of_time:
+            motivation += " and Out Of Time"
 
-        print("%s is moving %s because it is %s (Game %s - Turn %s)" % (self.context.me.name, direction, motivation,
-                                                                        self.context.game_id, self.context.turn))
+        self.motivation = motivation
+
+        # Time the whole move under the strategy that picked it
+        if metrics.ENABLED:
+            metrics.record('mover.' + motivation.lower().replace(' ', '_'), time.time() - started)
+            metrics.end_turn(self.context)
+
+        print("%s is moving %s because it is %s (Game %s - Turn %s) [Cache %s hits, %s misses]" % (
+            self.context.me.name, direction, motivation, self.context.game_id, self.context.turn,
+            self.context.table.hits - self._table_hits, self.context.table.misses - self._table_misses))
 
         return direction
 
     def best_path_to_food(self):
         if not self._best_path_to_food:
-            self._best_path_to_food = self.pathfinder.get_best_path_to_coords(self.context.me.head,
-                                                                              self.context.board.food,
-                                                                              self.context.me.health)
+            me = self.context.me
+            territory = self.pathfinder.territory()
+
+            # Go after food we can get to before any other snake first, then any food at all
+            our_food = [coord for coord in self.context.board.food if territory.owns(me, coord)]
+
+            self._best_path_to_food = \
+                (our_food and self.pathfinder.get_best_path_to_coords(me.head, our_food, me.health)) or \
+                self.pathfinder.get_best_path_to_coords(me.head, self.context.board.food, me.health)
         return self._best_path_to_food
 
     def best_path_to_my_tail(self):
@@ -103,16 +151,15 @@ class Mover(object):
         return self._best_path_to_my_tail
 
     def _get_path_to_body_segment_closest_to_tail(self, snakes):
-        # Try and path to the segment of the snake's body closest to the tail,
-        # as long as the tail will be there when we arrive
+        # Try and path next to the segment of the snake's body closest to the tail,
+        # arriving once it's about to move on, from one search of when we can be where
         for snake in snakes:
             for index, coord in enumerate(reversed(snake.body)):
-                body_paths = self.pathfinder.get_paths_to_coords(self.context.me.head, get_coord_neighbors(coord))
-                valid_body_paths = [path for path in body_paths if len(path[1]) >= index + 1]
+                path = self.pathfinder.get_timed_path_next_to(self.context.me.head, coord, index)
 
                 # We found a way out! Probably...
-                if valid_body_paths:
-                    return min(valid_body_paths, key=lambda x: x[0])
+                if path:
+                    return path
 
         return None
 
@@ -131,13 +178,23 @@ class Mover(object):
         smaller_snake_heads = [snake.head for snake in self.context.board.snakes
                                if snake.name != self.context.me.name and snake.length < self.context.me.length]
 
-        pathfinder_without_fatal_heads = deepcopy(self.pathfinder)
+        pathfinder_without_fatal_heads = self.pathfinder.branch()
         pathfinder_without_fatal_heads.remove_fatal_coords(smaller_snake_heads)
 
         return pathfinder_without_fatal_heads.get_best_path_to_coords(self.context.me.head,
                                                                       smaller_snake_heads,
                                                                       self.context.me.health)
 
+    def _get_lookahead_path(self):
+        best_move = Lookahead(self.context).best_move()
+
+        return (best_move[0], [self.context.me.head, best_move[1]]) if best_move else None
+
+    def _get_rollout_path(self):
+        best_move = RolloutSelector(self.context, pool=get_pool()).best_move()
+
+        return (best_move[0], [self.context.me.head, best_move[1]]) if best_move else None
+
     def _get_safest_moves(self):
         valid_moves_and_costs = [(self.pathfinder.get_cost(self.context.me.head, coord), coord)
                                  for coord in self.pathfinder.valid_moves()]
@@ -148,14 +205,7 @@ class Mover(object):
 
         return [None]
 
-    def _get_pathfinder_for_move(self, coord):
-        future_context = deepcopy(self.context)
-
-        is_food = coord in future_context.board.food
-
-        if is_food:
-            future_context.board.food.remove(coord)
-
-        future_context.me.moved(coord, is_food)
-
-        return PathFinder(future_context)
+    # Look at the board as if we'd made the move, without copying it
+    def _can_reach_after_move(self, move, coord):
+        with self.context.moved(move):
+            return PathFinder(self.context).get_path_to_coord(move, coord) is not None
@@ -0,0 +1,154 @@
+from array import array
+from itertools import islice
+
+from app.bitboard import count, get_masks
+from app.utility import get_absolute_distance, sub_coords
+
+# Least weight a move gets for the room it leaves, so even moves into no room at all have some chance,
+# since a snake that's about to lose can still take us with it
+MIN_SPACE = 0.05
+
+# How hard snakes go for food before we've seen what they do, at full health and when starving
+MIN_FOOD_PULL = 0.5
+MAX_FOOD_PULL = 0.9
+
+
+class SnakeHistory(object):
+    """
+    What we've seen a snake do earlier in the game.
+    """
+
+    def __init__(self):
+        self.moves = 0
+        self.straight = 0  # Moves that kept going the same way
+        self.food_moves = 0  # Moves made while there was food on the board
+        self.toward_food = 0  # Of those, the moves that got closer to the nearest food
+
+
+def observe_moves(history, previous_bodies, previous_food, board):
+    # type: (dict, dict, list, Board) -> None
+    """
+    Records the moves every snake made since last turn.
+    :param history: Each snake's history, by snake id, which is updated in place.
+    :param previous_bodies: Every snake's body on the last turn, by snake id.
+    :param previous_food: Food on the board on the last turn.
+    :param board: This turn's board.
+    """
+    for snake in board.snakes:
+        body = previous_bodies.get(snake.id)
+
+        if not body or get_absolute_distance(body[0], snake.head) != 1:
+            continue
+
+        record = history.setdefault(snake.id, SnakeHistory())
+        record.moves += 1
+
+        if len(body) > 1 and body[1] != body[0] and sub_coords(snake.head, body[0]) == sub_coords(body[0], body[1]):
+            record.straight += 1
+
+        if previous_food:
+            record.food_moves += 1
+
+            if _food_distance(snake.head, previous_food) < _food_distance(body[0], previous_food):
+                record.toward_food += 1
+
+
+def _food_distance(coord, food):
+    return min(get_absolute_distance(coord, food_coord) for food_coord in food)
+
+
+class OpponentModel(object):
+    """
+    Predicts how likely each enemy is to make each of its moves next turn, from how much room the move leaves it,
+    how much closer it gets to food and what we've seen it do earlier in the game. Each of those gives every move
+    a weight, which are multiplied together and normalised into a chance for each move.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.predictions = {}  # Chance of each of a snake's moves, by snake id
+
+        grid = context.grid
+        geometry = grid.geometry
+        masks = get_masks(geometry.width, geometry.height)
+
+        # Cells that won't have been moved out of by next turn, which is everything but the tails
+        # Stacked tails are in the body twice, so they stay blocked
+        blocked = 0
+        for snake in context.board.snakes:
+            blocked |= masks.bits(islice(snake.body, 0, snake.length - 1))
+
+        for snake in context.enemy_snakes():
+            if not grid.in_bounds(snake.head):
+                self.predictions[snake.id] = {}
+                continue
+
+            moves = [neighbor for neighbor in geometry.neighbors[geometry.index(snake.head)]
+                     if not grid.occupant[neighbor] or grid.vacates_at(neighbor) == 1]
+            weights = self._weights(snake, moves, masks, blocked)
+            total = sum(weights)
+
+            self.predictions[snake.id] = dict((geometry.coords[move], weight / total)
+                                              for move, weight in zip(moves, weights))
+
+        self._danger = None
+
+    def _weights(self, snake, moves, masks, blocked):
+        geometry = self.context.grid.geometry
+        history = self.context.history.get(snake.id) or SnakeHistory()
+        food = self.context.board.food
+
+        # Snakes tend to keep doing what we've seen them do, starting from an even chance either way
+        straight_chance = (history.straight + 1) / float(history.moves + 2)
+
+        # Hungry snakes go for food harder, until we've seen how they actually play
+        pull = MIN_FOOD_PULL + (MAX_FOOD_PULL - MIN_FOOD_PULL) * max(0, min(1, 1 - snake.health / 100.0))
+        food_chance = (history.toward_food + pull) / float(history.food_moves + 1)
+
+        neck = snake.body[1] if snake.length > 1 and snake.body[1] != snake.head else None
+        heading = sub_coords(snake.head, neck) if neck else None
+
+        weights = []
+
+        for move in moves:
+            coord = geometry.coords[move]
+
+            # Room to move, up to enough to fit the snake's whole body
+            room = count(masks.flood_fill(1 << move, blocked & ~(1 << move), snake.length))
+            weight = max(min(room, snake.length) / float(snake.length), MIN_SPACE)
+
+            if heading:
+                weight *= straight_chance if sub_coords(coord, snake.head) == heading else 1 - straight_chance
+
+            if food:
+                closer = _food_distance(coord, food) < _food_distance(snake.head, food)
+                weight *= food_chance if closer else 1 - food_chance
+
+            weights.append(weight)
+
+        return weights
+
+    def move_chances(self, snake):
+        # type: (Snake) -> list
+        """
+        :return: (chance, coord) for each of a snake's moves, most likely first.
+        """
+        return sorted(((chance, coord) for coord, chance in self.predictions.get(snake.id, {}).items()), reverse=True)
+
+    # Chance that a snake that would win a head on collision with us moves into each cell next turn,
+    # indexed the same way as the context's grid
+    def danger_field(self):
+        if self._danger is None:
+            self._danger = array('d', bytes(8 * self.context.grid.geometry.size))
+
+            for snake in self.context.enemy_snakes():
+                if snake.length < self.context.me.length:
+                    continue
+
+                for coord, chance in self.predictions[snake.id].items():
+                    self._danger[self.context.grid.index(coord)] += chance
+
+        return self._danger
+
+    def danger_at(self, coord):
+        return self.danger_field()[self.context.grid.index(coord)]
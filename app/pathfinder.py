@@ -1,29 +1,40 @@
+from array import array
+from copy import copy
 from typing import List
-from pypaths import astar
+from app import metrics
+from app.bitboard import count, get_masks
 from app.constants import *
+from app.opponents import OpponentModel
+from app.search import astar, check_deadline, dijkstra, earliest_arrivals, rebuild_path, rebuild_timed_path
+from app.territory import Territory
 from app.utility import *
 
 
 class PathFinder:
     def __init__(self, context):
         self.context = context
-        self._node_costs = {}
-
-        self._finder = self._get_astar_pathfinder()
-
-        self._node_costs = {}  # Used to cache node costs, so we don't recalc every time
+        self._cost_field = None  # Cost to move into every cell, so we don't recalc every time
+        self._fatal = None  # Fatal flag for every cell, indexed the same way as the context's grid
         self._fatal_coords = []
         self._body_danger = []
         self._head_danger_fill = []
         self._valid_moves = []
         self._coord_to_fill_size = {}
+        self._cost_maps = {}
+        self._arrivals = {}
+        self._territory = None
+        self._opponents = None
         self._is_trapped = False
+        self._state_hash = None
+        self._cacheable = True  # Whether results can be shared with other pathfinders for the same position
 
     # Used to calculate the danger in moving next to a snake, based on how close to the tail it is
     def body_danger(self):
         if not self._body_danger:
-            self._body_danger = [(coord, len(snake.body) - index) for snake in self.context.board.snakes
-                                 for index, coord in enumerate(snake.body) if coord != self.context.me.head]
+            grid = self.context.grid
+            my_head = grid.index(self.context.me.head)
+            self._body_danger = [(grid.coord(index), grid.vacates_at(index))
+                                 for index, number in enumerate(grid.occupant) if number and index != my_head]
 
         return self._body_danger
 
@@ -37,8 +48,8 @@ class PathFinder:
     # For each valid move, find the size of the area we'd be moving into
     def coord_to_fill_size(self):
         if not self._coord_to_fill_size:
-            fill_coords = dict((move, self.flood_fill(move, self.context.me.length * 2)) for move in self.valid_moves())
-            self._coord_to_fill_size = dict([(coord, len(fill)) for coord, fill in fill_coords.items()])
+            self._coord_to_fill_size = self._cached('fill', lambda: self.flood_fill_sizes(
+                self.valid_moves(), self.context.me.length * 2))
 
         return self._coord_to_fill_size
 
@@ -58,23 +69,127 @@ class PathFinder:
 
         return self._head_danger_fill
 
-    # Determines the size of the safe area around a coord
+    # Which snake gets to each cell first
+    def territory(self):
+        if self._territory is None:
+            self._territory = Territory(self.context)
+
+        return self._territory
+
+    # Where each enemy is likely to move next turn
+    # This depends on what we've seen them do this game, as well as the position, so it isn't cached by position
+    def opponents(self):
+        if self._opponents is None:
+            self._opponents = OpponentModel(self.context)
+
+        return self._opponents
+
+    # Zobrist hash of the position this pathfinder is planning for
+    def state_hash(self):
+        if self._state_hash is None:
+            self._state_hash = self.context.hash
+
+        return self._state_hash
+
+    # Looks up a result in the transposition table, or calculates and stores it
+    # Only small results are worth keeping, anything the size of the board costs more memory than it saves time
+    def _cached(self, name, calculate):
+        if not self._cacheable:
+            return calculate()
+
+        key = (name, self.state_hash())
+        result = self.context.table.get(key)
+
+        if result is None:
+            result = calculate()
+            self.context.table.put(key, result)
+
+        return result
+
+    # Determines the size of the safe area around a coord, as (coord, depth) pairs
+    # A max fill size of N yields at most N - 1 coords, which is what the fill size thresholds are tuned to
+    # Each cell's unexplored neighbors are filled depth first, in the same order as the recursive fill this replaced,
+    # so a cell's depth is when the fill first got to it rather than its distance, and max depth cuts off the same cells
+    @metrics.timed('pathfinder.flood_fill')
     def flood_fill(self, start_coord, max_fill_size=None, max_depth=None):
-        def recurse_fill(coords, explored, depth):
-            if max_fill_size is not None and len(explored) >= max_fill_size:
-                return explored
+        grid = self.context.grid
+        limit = max_fill_size - 1 if max_fill_size else None
 
-            explored.extend([(coord, depth) for coord in coords])
+        visited = bytearray(grid.width * grid.height)
+        explored = []
 
-            if max_depth is None or depth < max_depth:
-                for coord in coords:
-                    unexplored_neighbors = [neighbor for neighbor in self.get_valid_neighbors(coord)
-                                            if neighbor not in [coord for coord, depth in explored]]
-                    explored = recurse_fill(unexplored_neighbors, explored, depth + 1)
+        # Each frame is the coords filled at a depth, and how many of them we've filled out from so far
+        frames = []
+        coords = [start_coord]
+        depth = 0
 
-            return explored[:max_fill_size - 1] if max_fill_size else explored
+        while True:
+            check_deadline(self.context.deadline)
 
-        return recurse_fill([start_coord], [], 0)
+            # Start filling a new set of coords, unless we've already filled enough
+            if coords is not None and (max_fill_size is None or len(explored) < max_fill_size):
+                for coord in coords:
+                    visited[grid.index(coord)] = 1
+                    explored.append((coord, depth))
+
+                if max_depth is None or depth < max_depth:
+                    frames.append([coords, depth, 0])
+                else:
+                    self._truncate_fill(explored, visited, limit)
+
+            if not frames:
+                break
+
+            frame = frames[-1]
+            frame_coords, frame_depth, position = frame
+
+            if position < len(frame_coords):
+                frame[2] += 1
+                coords = [neighbor for neighbor in self.get_valid_neighbors(frame_coords[position])
+                          if not visited[grid.index(neighbor)]]
+                depth = frame_depth + 1
+            else:
+                frames.pop()
+                self._truncate_fill(explored, visited, limit)
+                coords = None
+
+        return explored
+
+    # Drops any coords a fill has gone past its limit with, so they can be filled again
+    def _truncate_fill(self, explored, visited, limit):
+        if limit is not None and len(explored) > limit:
+            for coord, depth in explored[limit:]:
+                visited[self.context.grid.index(coord)] = 0
+
+            del explored[limit:]
+
+    # Finds the flood fill size for each start coord in a single pass over the board,
+    # with the same max fill size rules as flood_fill
+    @metrics.timed('pathfinder.flood_fill_sizes')
+    def flood_fill_sizes(self, start_coords, max_fill_size=None):
+        grid = self.context.grid
+        masks = get_masks(grid.width, grid.height)
+        fatal = masks.from_flags(self._fatal_mask())
+        limit = max_fill_size - 1 if max_fill_size else None
+
+        # Areas that have already been filled, so starts that share an area only get filled once
+        areas = []
+        fill_sizes = {}
+
+        for start_coord in start_coords:
+            check_deadline(self.context.deadline)
+            start_bit = masks.bit(start_coord)
+            size = next((area_size for area, area_size in areas if area & start_bit), None)
+
+            if size is None:
+                # Fills go a whole frontier at a time, so they're cut down to the limit afterwards
+                area = masks.flood_fill(start_bit, fatal & ~start_bit, max_size=limit)
+                size = count(area) if limit is None else min(count(area), limit)
+                areas.append((area, size))
+
+            fill_sizes[start_coord] = size
+
+        return fill_sizes
 
     # # TODO: Use this?
     # # Finds the best path to fill an area
@@ -107,14 +222,42 @@ class PathFinder:
         # or len(snake.body) - (snake.body.index(coord) + 1) >=
         # min(get_absolute_distance(self.context.me.head, coord), len(snake.body), foresight_distance))
         if not self._fatal_coords:
-            self._fatal_coords = [coord for snake in self.context.board.snakes for coord in snake.body
-                                  if coord != snake.tail or (is_adjacent_to_coord(self.context.me.head, snake.tail) and
-                                                             snake.body.count(snake.tail) > 1)]
+            grid = self.context.grid
+            self._fatal_coords = [grid.coord(index) for index, fatal in enumerate(self._fatal_mask()) if fatal]
 
         return self._fatal_coords
 
     def remove_fatal_coords(self, coords_to_remove):
-        self._fatal_coords = list(set(self._fatal_coords) - set(coords_to_remove))
+        fatal = self._fatal_mask()
+
+        for coord in coords_to_remove:
+            fatal[self.context.grid.index(coord)] = 0
+
+        self._fatal_coords = []
+        self._cost_maps = {}
+
+    # A pathfinder for the same turn, that shares what's already been worked out,
+    # but whose fatal coords can be changed without affecting this one
+    @metrics.timed('pathfinder.branch')
+    def branch(self):
+        pathfinder = copy(self)
+        pathfinder._fatal = bytearray(self._fatal_mask())
+        pathfinder._fatal_coords = []
+        pathfinder._cost_maps = {}
+        pathfinder._cacheable = False
+
+        return pathfinder
+
+    def _fatal_mask(self):
+        if self._fatal is None:
+            grid = self.context.grid
+            self._fatal = bytearray(1 if number else 0 for number in grid.occupant)
+
+            for snake in self.context.board.snakes:
+                if not (is_adjacent_to_coord(self.context.me.head, snake.tail) and snake.body.count(snake.tail) > 1):
+                    self._fatal[grid.index(snake.tail)] = 0
+
+        return self._fatal
 
     # # How far ahead we want to try and predict tail positions
     # def set_foresight(self, foresight_distance):
@@ -122,91 +265,170 @@ class PathFinder:
 
     # TODO: Not sure this is working the way I think. Node 1 and Node 2
     # Node cost calculation, which will make more dangerous paths cost more
+    @metrics.timed('pathfinder.get_cost')
     def get_cost(self, node1, node2):
-        # See whether we've already performed the cost calc for this node
-        cached_cost = self._node_costs.get(node2)
-
-        if cached_cost:
-            return cached_cost
-
-        cost = 0
-
-        # Food costs more to path into, to prevent us from growing too much
-        if node2 in self.context.board.food:
-            cost += self.context.dna[FOOD_COST]
-
-        # # Are we limiting our future moves?
-        # if valid_node_neighbor_count < 3:
-        #     # Pathing near walls costs more
-        #     adjacent_wall_count = len([c for i, c in enumerate(node2)
-        #                                if c == 0 or c == (self.context.board.width, self.context.board.height)[i] - 1])
-        #     cost += adjacent_wall_count * self.context.dna[WALL_DANGER_COST]
-        #
-        #     # Pathing near other snake's bodies is more expensive, based on how close to the head we are
-        #     # cost += sum([danger * self.context.dna[BODY_DANGER_COST] for coord, danger in self.body_danger()
-        #     #              if is_adjacent_to_coord(node2, coord)])
-        #
-        #     # Moving into a corridor is BAD NEWS!
-        #     if valid_node_neighbor_count == 1:
-        #         cost *= 2
-
-        cost += (abs(node2[0] - (self.context.board.width / 2)) +
-                 abs(node2[1] - (self.context.board.height / 2))) * WALL_DANGER_COST
-
-        # Squares nearer to other snakes heads are more dangerous
-        cost += sum([1 / float(danger or 1) for coord, danger in self.head_danger_fill()
-                     if coord == node2]) * self.context.dna[HEAD_DANGER_COST]
-        #
-        # valid_node_neighbor_count = len(self.get_valid_neighbors(node2))
-        #
-        # # More options is better
-        # cost *= 3 / valid_node_neighbor_count if valid_node_neighbor_count else 10
-
-        if node2 in self.coord_to_fill_size().keys():
-            cost += self.context.dna[TRAP_DANGER_COST] / self.coord_to_fill_size()[node2]
-
-        # Make sure the cost is always at least the base cost
-        node_cost = max(cost, self.context.dna[BASE_COST])
-
-        # Add to cache
-        self._node_costs[node2] = node_cost
-
-        return node_cost
+        return self.cost_field()[self.context.grid.index(node2)]
+
+    # Cost to move into each cell on the board, indexed the same way as the context's grid
+    @metrics.timed('pathfinder.cost_field')
+    def cost_field(self):
+        if self._cost_field is None:
+            grid = self.context.grid
+            geometry = grid.geometry
+            dna = self.context.dna
+            half_width = self.context.board.width / 2
+            half_height = self.context.board.height / 2
+
+            # # Are we limiting our future moves?
+            # if valid_node_neighbor_count < 3:
+            #     # Pathing near walls costs more
+            #     adjacent_wall_count = len([c for i, c in enumerate(node2)
+            #                                if c == 0 or c == (self.context.board.width, self.context.board.height)[i] - 1])
+            #     cost += adjacent_wall_count * self.context.dna[WALL_DANGER_COST]
+            #
+            #     # Pathing near other snake's bodies is more expensive, based on how close to the head we are
+            #     # cost += sum([danger * self.context.dna[BODY_DANGER_COST] for coord, danger in self.body_danger()
+            #     #              if is_adjacent_to_coord(node2, coord)])
+            #
+            #     # Moving into a corridor is BAD NEWS!
+            #     if valid_node_neighbor_count == 1:
+            #         cost *= 2
+            costs = array('d', [(abs(x - half_width) + abs(y - half_height)) * WALL_DANGER_COST
+                                for x, y in geometry.coords])
+
+            # Food costs more to path into, to prevent us from growing too much
+            for coord in set(self.context.board.food):
+                costs[grid.index(coord)] += dna[FOOD_COST]
+
+            # Squares nearer to other snakes heads are more dangerous
+            head_danger = [0] * geometry.size
+            for coord, danger in self.head_danger_fill():
+                head_danger[grid.index(coord)] += 1 / float(danger or 1)
+
+            for index, danger in enumerate(head_danger):
+                if danger:
+                    costs[index] += danger * dna[HEAD_DANGER_COST]
+
+            # Plus the chance a snake that would beat us moves there next turn
+            for index, danger in enumerate(self.opponents().danger_field()):
+                if danger:
+                    costs[index] += danger * dna[HEAD_DANGER_COST]
+            #
+            # valid_node_neighbor_count = len(self.get_valid_neighbors(node2))
+            #
+            # # More options is better
+            # cost *= 3 / valid_node_neighbor_count if valid_node_neighbor_count else 10
+
+            for coord, fill_size in self.coord_to_fill_size().items():
+                costs[grid.index(coord)] += dna[TRAP_DANGER_COST] / fill_size
+
+            # Make sure the cost is always at least the base cost
+            for index, cost in enumerate(costs):
+                if cost < dna[BASE_COST]:
+                    costs[index] = dna[BASE_COST]
+
+            self._cost_field = costs
+
+        return self._cost_field
 
     # Find non-fatal node neighbors
+    @metrics.timed('pathfinder.get_valid_neighbors')
     def get_valid_neighbors(self, coord):
-        # Possible neighbors of input coords
-        coord_neighbors = get_coord_neighbors(coord)
+        geometry = self.context.grid.geometry
+        fatal = self._fatal_mask()
 
-        valid_neighbors = [
-            neighbor for neighbor in coord_neighbors
-            if 0 <= neighbor[0] < self.context.board.width  # X Coord must be within board
-               and 0 <= neighbor[1] < self.context.board.height  # Y Coord must be within board
-               and (neighbor not in self.fatal_coords())  # Don't crash into any snake
-        ]
+        if not geometry.in_bounds(coord):
+            return [neighbor for neighbor in get_coord_neighbors(coord)
+                    if geometry.in_bounds(neighbor) and not fatal[geometry.index(neighbor)]]
 
-        return valid_neighbors
+        # Neighbors must be within the board, and we don't want to crash into any snake
+        index = geometry.index(coord)
+        return [neighbor for neighbor, neighbor_index in zip(geometry.neighbor_coords[index], geometry.neighbors[index])
+                if not fatal[neighbor_index]]
 
-    def _get_astar_pathfinder(self):
-        # Used by the astar algorithm to evaluate node costs
-        def cost_func(node1, node2):
-            return self.get_cost(node1, node2)
+    # Returns the cheapest path to a coord, using the astar algorithm
+    @metrics.timed('pathfinder.astar')
+    def get_path_to_coord(self, source_coord, target_coord):
+        geometry = self.context.grid.geometry
 
-        # Used by the astar algorithm to evaluate path nodes
-        def neighbors_func(node):
-            return self.get_valid_neighbors(node)
+        if not geometry.in_bounds(target_coord):
+            return None
 
-        # Create the astar path finder
-        return astar.pathfinder(neighbors=neighbors_func, cost=cost_func)
+        cost, path = astar(geometry, self._fatal_mask(), self.cost_field(),
+                           geometry.index(source_coord), geometry.index(target_coord), self.context.dna[BASE_COST],
+                           self.context.deadline)
 
-    # Returns the cheapest path to a coord, using the astar algorithm
-    def get_path_to_coord(self, source_coord, target_coord):
-        path = self._finder(source_coord, target_coord)
-        return path if path[0] else None
+        return (cost, [geometry.coords[index] for index in path]) if cost else None
+
+    # Finds the cheapest cost to every reachable cell from the source coord, in a single Dijkstra search
+    # Returns the cost and previous cell for each cell, so that paths can be rebuilt for any target
+    @metrics.timed('pathfinder.dijkstra')
+    def get_cost_map(self, source_coord):
+        if source_coord not in self._cost_maps:
+            geometry = self.context.grid.geometry
+            self._cost_maps[source_coord] = dijkstra(geometry, self._fatal_mask(), self.cost_field(),
+                                                     geometry.index(source_coord), self.context.deadline)
+
+        return self._cost_maps[source_coord]
+
+    # Returns the cheapest path from the source coord to the target coord, from the source's cost map
+    def get_mapped_path_to_coord(self, source_coord, target_coord):
+        geometry = self.context.grid.geometry
+
+        if target_coord == source_coord or not geometry.in_bounds(target_coord):
+            return None
 
-    # Returns the shortest paths to each coord, using the astar algorithm
+        costs, came_from = self.get_cost_map(source_coord)
+        target = geometry.index(target_coord)
+
+        if costs[target] is None:
+            return None
+
+        return costs[target], [geometry.coords[index] for index in rebuild_path(came_from, target)]
+
+    # Returns the cheapest paths to each coord, using a single search from the source coord
     def get_paths_to_coords(self, source_coord, target_coords):
-        return [path for path in [self.get_path_to_coord(source_coord, coord) for coord in target_coords] if path]
+        return [path for path in [self.get_mapped_path_to_coord(source_coord, coord) for coord in target_coords]
+                if path]
+
+    # Finds when we could be in every cell, where body segments can be moved into once they've moved on,
+    # in a single search over turns. Unlike the other searches, this doesn't depend on the fatal coords
+    # Our own body follows the path, so cells it goes through stay blocked until we've moved our length
+    def get_arrivals(self, source_coord):
+        if source_coord not in self._arrivals:
+            grid = self.context.grid
+            geometry = grid.geometry
+            free_at = [grid.vacates_at(index) for index in range(geometry.size)]
+
+            # Every segment on the board has moved on by the time the longest snake has moved its length
+            self._arrivals[source_coord] = earliest_arrivals(geometry, free_at, geometry.index(source_coord),
+                                                             max(grid.lengths), self.context.deadline,
+                                                             self.context.me.length)
+
+        return self._arrivals[source_coord]
+
+    def get_timed_path_next_to(self, source_coord, coord, min_turns):
+        # type: (tuple, tuple, int) -> tuple
+        """
+        Returns the cheapest path that ends next to a coord, as soon as we can get there after a number of turns.
+        :param source_coord: Coord to start from.
+        :param coord: Coord to end up next to.
+        :param min_turns: Fewest moves the path can take.
+        :return: Tuple of the path's cost and coords, or None if we can't get there.
+        """
+        geometry = self.context.grid.geometry
+        costs = self.cost_field()
+        earliest, layers = self.get_arrivals(source_coord)
+        neighbors = geometry.neighbors[geometry.index(coord)]
+
+        for turn in range(max(min_turns, 1), len(layers)):
+            paths = [rebuild_timed_path(layers, neighbor, turn) for neighbor in neighbors if neighbor in layers[turn]]
+
+            if paths:
+                path = min(paths, key=lambda path: sum(costs[index] for index in path[1:]))
+                return sum(costs[index] for index in path[1:]), [geometry.coords[index] for index in path]
+
+        return None
 
     def get_best_path_to_coords(self, source_coord, target_coords, health=100):
         # type: (tuple, List[tuple], int) -> tuple
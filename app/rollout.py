@@ -0,0 +1,271 @@
+import os
+import random
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from app.geometry import get_geometry
+from app.pathfinder import PathFinder
+
+# How long we're willing to spend playing out games, in seconds
+DEFAULT_TIME_BUDGET = 0.2
+
+# Turns each playout goes on for, unless we die first
+ROLLOUT_DEPTH = 20
+
+# Playouts of each move between checks of the deadline
+BATCH_SIZE = 4
+
+# Health below which snakes in a playout head for the closest food
+HUNGRY = 30
+MAX_HEALTH = 100
+
+# Score for each segment we grow in a playout, next to the 1 for surviving all of it
+GROWTH_WEIGHT = 0.05
+
+# Processes to split playouts across, 0 to play them all out in the process working out the move
+# Moves are already worked out in worker processes by the async server and batches, so this is off by default
+ROLLOUT_WORKERS = int(os.getenv('ROLLOUT_WORKERS', '0'))
+
+# Pool for playouts, started on the first move that needs it
+_pool = None
+
+
+class RolloutState(object):
+    """
+    Just enough of the board to play out games on, as flat cell indexes, with us as the first snake.
+    It only holds plain lists, so it's cheap to copy and send to other processes.
+    """
+
+    __slots__ = ('width', 'height', 'bodies', 'healths', 'food')
+
+    def __init__(self, context):
+        geometry = context.grid.geometry
+        snakes = [context.me] + context.enemy_snakes()
+
+        self.width = geometry.width
+        self.height = geometry.height
+        self.bodies = [[geometry.index(coord) for coord in snake.body] for snake in snakes]
+        self.healths = [snake.health for snake in snakes]
+        self.food = [geometry.index(coord) for coord in context.board.food]
+
+
+def stream_seed(seed, move, batch):
+    # type: (int, int, int) -> int
+    """
+    Seed for one batch of playouts, so a batch plays out the same wherever and whenever it runs.
+    :param seed: Seed for the whole move.
+    :param move: Cell index of the move being played out.
+    :param batch: Number of the batch for that move.
+    """
+    return (seed * 1000003 + move) * 1000003 + batch
+
+
+def playout(state, move, rng, depth=ROLLOUT_DEPTH):
+    # type: (RolloutState, int, random.Random, int) -> tuple
+    """
+    Plays out a game after we move into a cell, with every snake following a quick default policy:
+    a random move that doesn't crash, or a move towards food when hungry. No new food spawns.
+    :param state: Board to play out from.
+    :param move: Cell index we move into first.
+    :param rng: Random number stream for the snakes' moves.
+    :param depth: Most turns to play out.
+    :return: Tuple of the turns we survived, and how much we grew.
+    """
+    geometry = get_geometry(state.width, state.height)
+    neighbors = geometry.neighbors
+
+    bodies = [deque(body) for body in state.bodies]
+    healths = list(state.healths)
+    food = set(state.food)
+    alive = [True] * len(bodies)
+
+    # Segments in each cell, with stacked segments counted separately
+    occupied = bytearray(geometry.size)
+    for body in bodies:
+        for index in body:
+            occupied[index] += 1
+
+    start_length = len(bodies[0])
+
+    for turn in range(depth):
+        tails = set(body[-1] for number, body in enumerate(bodies) if alive[number] and occupied[body[-1]] == 1)
+        moves = [None] * len(bodies)
+
+        for number, body in enumerate(bodies):
+            if not alive[number]:
+                continue
+
+            if turn == 0 and number == 0:
+                moves[number] = move
+                continue
+
+            options = [neighbor for neighbor in neighbors[body[0]] if not occupied[neighbor] or neighbor in tails]
+
+            if options and food and healths[number] < HUNGRY:
+                distances = [min(geometry.distance(option, food_index) for food_index in food) for option in options]
+                closest = min(distances)
+                options = [option for option, distance in zip(options, distances) if distance == closest]
+
+            moves[number] = rng.choice(options) if options else None
+
+        for number, body in enumerate(bodies):
+            if not alive[number] or moves[number] is None:
+                continue
+
+            occupied[body.pop()] -= 1
+            body.appendleft(moves[number])
+            occupied[moves[number]] += 1
+            healths[number] -= 1
+
+        heads = {}
+        for number, body in enumerate(bodies):
+            if alive[number] and moves[number] is not None:
+                heads.setdefault(body[0], []).append(number)
+
+                if body[0] in food:
+                    healths[number] = MAX_HEALTH
+                    body.append(body[-1])
+                    occupied[body[-1]] += 1
+
+        food.difference_update(heads)
+
+        dead = []
+        for number, body in enumerate(bodies):
+            if not alive[number]:
+                continue
+
+            if moves[number] is None or healths[number] <= 0:
+                dead.append(number)
+                continue
+
+            others = heads[body[0]]
+
+            # Running into a body, or into a head that's at least as long as us
+            if occupied[body[0]] > len(others) or \
+                    any(other != number and len(bodies[other]) >= len(body) for other in others):
+                dead.append(number)
+
+        for number in dead:
+            alive[number] = False
+
+            for index in bodies[number]:
+                occupied[index] -= 1
+
+        if not alive[0]:
+            return turn, len(bodies[0]) - start_length
+
+    return depth, len(bodies[0]) - start_length
+
+
+def play_batch(state, move, seed, playouts=BATCH_SIZE, depth=ROLLOUT_DEPTH):
+    # type: (RolloutState, int, int, int, int) -> tuple
+    """
+    Plays out a batch of games after the same move. This can run in the pool's processes.
+    :return: Tuple of the number of playouts, how many we survived, and the total turns survived and growth.
+    """
+    rng = random.Random(seed)
+    survived = turns = growth = 0
+
+    for _ in range(playouts):
+        playout_turns, playout_growth = playout(state, move, rng, depth)
+        survived += playout_turns == depth
+        turns += playout_turns
+        growth += playout_growth
+
+    return playouts, survived, turns, growth
+
+
+class RolloutSelector(object):
+    """
+    Picks a move by playing out lots of quick random games after each of our moves, which is cheaper than
+    searching every combination of moves when there are a lot of snakes around. Playouts go in batches,
+    each with its own random number stream, until we run out of time, so the same batches always play out
+    the same way, whether they run here or in a pool.
+    """
+
+    def __init__(self, context, time_budget=DEFAULT_TIME_BUDGET, pool=None, max_batches=None):
+        self.context = context
+        self.time_budget = time_budget
+        self.pool = pool
+        self.max_batches = max_batches  # Most batches of each move to play out, or None to keep going until the deadline
+
+        self.stats = {}  # [playouts, survived, turns, growth] for each move's coord
+        self.seed = zlib.crc32(('%s-%s' % (context.game_id, context.turn)).encode('utf-8'))
+
+    def best_move(self):
+        # type: () -> tuple
+        """
+        Plays out games after each of our moves until the deadline.
+        :return: Tuple of the best move's score and coord, or None if we have no moves.
+        """
+        moves = PathFinder(self.context).valid_moves()
+
+        if not moves:
+            return None
+
+        deadline = time.time() + self.time_budget
+
+        # Don't play out games past the deadline for the whole move
+        if self.context.deadline is not None:
+            deadline = min(deadline, self.context.deadline)
+
+        state = RolloutState(self.context)
+        geometry = self.context.grid.geometry
+        indexes = [geometry.index(move) for move in moves]
+        self.stats = dict((move, [0, 0, 0, 0]) for move in moves)
+
+        batch = 0
+
+        # Every move gets at least one batch, so there's always something to go on
+        while batch == 0 or (time.time() < deadline and (self.max_batches is None or batch < self.max_batches)):
+            if self.pool:
+                results = self._play_in_pool(state, indexes, batch, deadline if batch else None)
+            else:
+                results = [(move, play_batch(state, index, stream_seed(self.seed, index, batch)))
+                           for move, index in zip(moves, indexes)]
+
+            for move, result in results:
+                self.stats[move] = [total + value for total, value in zip(self.stats[move], result)]
+
+            batch += 1
+
+        return max((self.score(move), move) for move in moves)
+
+    def _play_in_pool(self, state, indexes, batch, deadline):
+        geometry = self.context.grid.geometry
+        futures = dict((self.pool.submit(play_batch, state, index, stream_seed(self.seed, index, batch)),
+                        geometry.coords[index]) for index in indexes)
+        done, not_done = wait(futures, max(deadline - time.time(), 0) if deadline is not None else None)
+
+        for future in not_done:
+            future.cancel()
+
+        # Batches that didn't finish in time are left out, so every move's batches are still reproducible
+        return [(futures[future], future.result()) for future in done]
+
+    def score(self, move):
+        # type: (tuple) -> float
+        """
+        :return: Share of playout turns we survived after a move, plus a little for growing.
+        """
+        playouts, survived, turns, growth = self.stats[move]
+
+        if not playouts:
+            return 0.0
+
+        return turns / float(playouts * ROLLOUT_DEPTH) + GROWTH_WEIGHT * growth / float(playouts)
+
+
+def get_pool():
+    # type: () -> ProcessPoolExecutor
+    """
+    :return: Pool shared by every move in this process, or None if playouts aren't split across processes.
+    """
+    global _pool
+
+    if ROLLOUT_WORKERS and _pool is None:
+        _pool = ProcessPoolExecutor(ROLLOUT_WORKERS)
+
+    return _pool
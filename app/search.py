@@ -0,0 +1,187 @@
+import heapq
+import time
+from array import array
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# Stop searching if we've run out of time, a deadline of None means there's no limit
+def check_deadline(deadline):
+    if deadline is not None and time.time() > deadline:
+        raise DeadlineExceeded()
+
+
+def astar(geometry, blocked, costs, start, goal, heuristic_cost=1, deadline=None):
+    """
+    Finds the cheapest path between two cells, with the A* algorithm.
+    :param geometry: Geometry of the board being searched.
+    :param blocked: Per-cell flags, non-zero cells are never entered.
+    :param costs: Per-cell cost to enter each cell.
+    :param start: Cell index to start from.
+    :param goal: Cell index to find a path to.
+    :param heuristic_cost: Cheapest possible cost to enter a cell, used to scale the distance heuristic.
+    :param deadline: Time to give up by, raising DeadlineExceeded.
+    :return: Tuple of the path cost and its cells, or (None, []) if the goal can't be reached.
+    """
+    if start == goal:
+        return 0, [start]
+
+    neighbors = geometry.neighbors
+    xs = geometry.xs
+    ys = geometry.ys
+    goal_x = xs[goal]
+    goal_y = ys[goal]
+
+    g_scores = [None] * geometry.size
+    came_from = array('i', [-1]) * geometry.size
+    closed = bytearray(geometry.size)
+    g_scores[start] = 0
+    open_set = [(0, 0, start)]
+    pushed = 1
+
+    while open_set:
+        check_deadline(deadline)
+        _, _, current = heapq.heappop(open_set)
+
+        if current == goal:
+            return g_scores[goal], rebuild_path(came_from, goal)
+
+        if closed[current]:
+            continue
+
+        closed[current] = 1
+        current_score = g_scores[current]
+
+        for neighbor in neighbors[current]:
+            if blocked[neighbor] or closed[neighbor]:
+                continue
+
+            score = current_score + costs[neighbor]
+
+            if g_scores[neighbor] is None or score < g_scores[neighbor]:
+                g_scores[neighbor] = score
+                came_from[neighbor] = current
+                estimate = score + (abs(xs[neighbor] - goal_x) + abs(ys[neighbor] - goal_y)) * heuristic_cost
+                heapq.heappush(open_set, (estimate, pushed, neighbor))
+                pushed += 1
+
+    return None, []
+
+
+def dijkstra(geometry, blocked, costs, start, deadline=None):
+    """
+    Finds the cheapest cost to every reachable cell from the start cell.
+    :return: Tuple of per-cell costs (None if unreachable) and previous cells (-1 for none).
+    """
+    neighbors = geometry.neighbors
+
+    scores = [None] * geometry.size
+    came_from = array('i', [-1]) * geometry.size
+    closed = bytearray(geometry.size)
+    scores[start] = 0
+    open_set = [(0, 0, start)]
+    pushed = 1
+
+    while open_set:
+        check_deadline(deadline)
+        current_score, _, current = heapq.heappop(open_set)
+
+        if closed[current]:
+            continue
+
+        closed[current] = 1
+
+        for neighbor in neighbors[current]:
+            if blocked[neighbor] or closed[neighbor]:
+                continue
+
+            score = current_score + costs[neighbor]
+
+            if scores[neighbor] is None or score < scores[neighbor]:
+                scores[neighbor] = score
+                came_from[neighbor] = current
+                heapq.heappush(open_set, (score, pushed, neighbor))
+                pushed += 1
+
+    return scores, came_from
+
+
+# Walk back through the previous cells, to get the path that ends at the given cell
+def rebuild_path(came_from, end):
+    path = [end]
+
+    while came_from[path[-1]] != -1:
+        path.append(came_from[path[-1]])
+
+    return path[::-1]
+
+
+def earliest_arrivals(geometry, free_at, start, max_time, deadline=None, trail=0):
+    """
+    Finds when we could be in each cell, moving one cell every turn, in a single breadth first search
+    over turns. Cells can only be entered from the turn they're free, so body segments open up as they move on.
+    Only one way of getting to each cell on each turn is kept, so a cell is only reachable if that way can get there.
+    :param geometry: Geometry of the board being searched.
+    :param free_at: Per-cell first turn each cell can be entered, 0 for cells that are already free.
+    :param start: Cell index to start from.
+    :param max_time: Most turns to look ahead.
+    :param deadline: Time to give up by, raising DeadlineExceeded.
+    :param trail: Turns a cell stays blocked after a path moves into it, which is the length of the body
+        following the path, or 0 to let paths move back through themselves.
+    :return: Tuple of the earliest turn we can be in each cell (-1 if we can't in time),
+        and for each turn, the cells we could be in then mapped to the cell we'd have come from.
+    """
+    neighbors = geometry.neighbors
+    earliest = array('i', [-1]) * geometry.size
+    earliest[start] = 0
+    layers = [{start: -1}]
+
+    for turn in range(1, max_time + 1):
+        check_deadline(deadline)
+        layer = {}
+
+        for index in layers[-1]:
+            moves = [neighbor for neighbor in neighbors[index] if neighbor not in layer and free_at[neighbor] <= turn]
+
+            # Cells the kept path moved into in the last few turns are still under our body
+            # The path can't have been in a cell before the first turn we could get there, so the walk back
+            # only needs to go as far as the earliest of the cells we're moving to
+            reached = [earliest[neighbor] for neighbor in moves if 0 <= earliest[neighbor] < turn]
+
+            if trail > 1 and reached:
+                stop = max(min(reached), turn - trail + 1)
+                cell = index
+                cell_turn = turn - 1
+                trail_cells = set()
+
+                while cell != -1 and cell_turn >= stop:
+                    trail_cells.add(cell)
+                    cell = layers[cell_turn][cell]
+                    cell_turn -= 1
+
+                moves = [neighbor for neighbor in moves if neighbor not in trail_cells]
+
+            for neighbor in moves:
+                layer[neighbor] = index
+
+                if earliest[neighbor] == -1:
+                    earliest[neighbor] = turn
+
+        if not layer:
+            break
+
+        layers.append(layer)
+
+    return earliest, layers
+
+
+# Walk back through the turns, to get the path that's in the given cell on the given turn
+def rebuild_timed_path(layers, end, turn):
+    path = [end]
+
+    for previous_turn in range(turn, 0, -1):
+        path.append(layers[previous_turn][path[-1]])
+
+    return path[::-1]
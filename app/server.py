@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote
+
+import bottle
+
+from app import metrics
+from app.api import *
+from app.batch import DEFAULT_WORKERS, group_requests, move_group, read_batch
+from app.context import Context
+from app.games import games
+from app.main import S4_COLORS, index, move_time_budget, warm_up
+from app.mover import Mover
+from app.pathfinder import PathFinder
+
+# Moves that can be in the pool at once, per worker, before new ones have to wait for a slot
+QUEUE_DEPTH = 2
+
+# How long past its deadline we'll wait for a worker's move, in seconds, before answering without it
+DEADLINE_GRACE = 0.05
+
+# Largest request body we'll read, in bytes
+MAX_BODY_SIZE = 1024 * 1024
+
+
+def compute_move(data, dna, traits, deadline):
+    # type: (dict, str, str, float) -> str
+    """
+    Works out a move. This runs in the worker processes, each with its own game cache.
+    :return: Direction to move.
+    """
+    return Mover(Context(data, dna, traits, games)).next_move(deadline)
+
+
+def run_in_worker(func, *args):
+    """
+    Runs a function in a worker process, sending back the worker's timings along with its result
+    when metrics are enabled, so the server can report every worker's timings.
+    :return: Tuple of the worker's process id, its timings or None, and the function's result.
+    """
+    result = func(*args)
+
+    return os.getpid(), metrics.snapshot() if metrics.ENABLED else None, result
+
+
+def fallback_move(data):
+    # type: (dict) -> str
+    """
+    A move that's quick enough to work out without a worker, for when the pool can't get to us in time.
+    :return: Direction of the first move that doesn't crash, or up if there isn't one.
+    """
+    context = Context(data, '', '')
+    moves = PathFinder(context).valid_moves()
+
+    return context.grid.geometry.direction(context.me.head, moves[0]) if moves else 'up'
+
+
+class AsyncServer(object):
+    """
+    Serves the same routes as the bottle app from a single asyncio event loop, with moves worked out
+    in a pool of processes, so a slow move never holds up pings, starts, ends or other games' moves.
+    Only so many moves can be in the pool at once; a move that can't get a slot, or whose worker
+    doesn't answer before its deadline, gets a fallback move instead.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, queue_depth=QUEUE_DEPTH):
+        self.workers = workers
+        self.queue_depth = queue_depth
+
+        self.pool = None
+        self._slots = None
+        self._server = None
+
+        self.fallbacks = 0  # Times we answered without a worker
+        self.worker_metrics = {}  # Latest timings from each worker, by process id
+
+    async def start(self, host='0.0.0.0', port=8080):
+        self.pool = ProcessPoolExecutor(self.workers)
+
+        # Fork the workers before we accept any connections, otherwise they'd inherit the sockets
+        # and hold connections open after we've closed them
+        await asyncio.get_event_loop().run_in_executor(self.pool, os.getpid)
+
+        self._slots = asyncio.Semaphore(self.workers * self.queue_depth)
+        self._server = await asyncio.start_server(self.handle_connection, host, port)
+
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self, host='0.0.0.0', port=8080):
+        await self.start(host, port)
+
+        try:
+            # Connections are handled as they come in, until we're stopped
+            await asyncio.get_event_loop().create_future()
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+        if self.pool:
+            self.pool.shutdown(wait=False)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+
+                if request is None:
+                    break
+
+                method, path, headers, body = request
+                response = await self.dispatch(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+
+                writer.write(self._serialize(response, keep_alive))
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body):
+        # type: (str, str, bytes) -> bottle.HTTPResponse
+        """
+        Routes a request the same way as the bottle app, optionally under /<traits>/ or /<dna>/<traits>/.
+        :return: Response to send.
+        """
+        parts = [unquote(part) for part in path.split('?', 1)[0].split('/')[1:]]
+
+        if 'static' in parts[:3]:
+            static_index = parts.index('static')
+            return bottle.static_file('/'.join(parts[static_index + 1:]), root='static/')
+
+        prefix, action = parts[:-1], parts[-1]
+
+        if len(prefix) > 2:
+            return bottle.HTTPResponse(status=404)
+
+        dna, traits = [''] * (2 - len(prefix)) + prefix
+
+        if method == 'GET' and action == '':
+            return bottle.HTTPResponse(status=200, body=index())
+        elif method == 'POST' and action == 'ping':
+            return ping_response()
+        elif method == 'POST' and action == 'start':
+            return start_response(random.choice(list(S4_COLORS.values())))
+        elif method == 'POST' and action == 'move':
+            return move_response(await self.move(loads(body), dna, traits))
+        elif method == 'POST' and action == 'batch':
+            return batch_response(await self.move_batch(read_batch(loads(body), dna, traits)))
+        elif method == 'POST' and action == 'end':
+            # Workers forget about games on their own, once they stop hearing about them
+            return end_response()
+        elif method == 'GET' and action == 'metrics':
+            return metrics_response(metrics.exposition(metrics.merge(metrics.snapshot(),
+                                                                     *self.worker_metrics.values())))
+
+        return bottle.HTTPResponse(status=404)
+
+    async def move(self, data, dna, traits):
+        # type: (dict, str, str) -> str
+        """
+        Works out a move in the pool, or falls back to a quick move if the pool can't answer by the deadline.
+        :return: Direction to move.
+        """
+        deadline = time.time() + move_time_budget(data)
+
+        return await self._in_pool(deadline, lambda: fallback_move(data), compute_move, data, dna, traits, deadline)
+
+    async def move_batch(self, requests):
+        # type: (list) -> list
+        """
+        Works out moves for a batch of requests, spread across the pool in groups that share their boards.
+        :param requests: (dna, traits, data) for each request.
+        :return: Direction for each request, in the same order.
+        """
+        if not requests:
+            return []
+
+        deadline = time.time() + min(move_time_budget(data) for _, _, data in requests)
+        groups = group_requests(requests, self.workers)
+        directions = [None] * len(requests)
+
+        results = await asyncio.gather(*[
+            self._in_pool(deadline, lambda group=group: [(index, fallback_move(data)) for index, _, _, data in group],
+                          move_group, group, deadline)
+            for group in groups])
+
+        for moves in results:
+            for index, direction in moves:
+                directions[index] = direction
+
+        return directions
+
+    async def _in_pool(self, deadline, fallback, func, *args):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), max(deadline - time.time(), 0))
+        except asyncio.TimeoutError:
+            self.fallbacks += 1
+            return fallback()
+
+        future = asyncio.get_event_loop().run_in_executor(self.pool, run_in_worker, func, *args)
+        # The slot is only free once the worker is, even if we've stopped waiting for it
+        future.add_done_callback(self._worker_done)
+
+        try:
+            _, _, result = await asyncio.wait_for(asyncio.shield(future),
+                                                  max(deadline - time.time(), 0) + DEADLINE_GRACE)
+            return result
+        except asyncio.TimeoutError:
+            self.fallbacks += 1
+            return fallback()
+
+    def _worker_done(self, future):
+        self._slots.release()
+
+        if not future.cancelled() and future.exception() is None:
+            pid, timings, _ = future.result()
+
+            if timings is not None:
+                self.worker_metrics[pid] = timings
+
+    @staticmethod
+    async def _read_request(reader):
+        request_line = await reader.readline()
+
+        if not request_line.strip():
+            return None
+
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+
+        while True:
+            line = await reader.readline()
+
+            if line in (b'\r\n', b'\n', b''):
+                break
+
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+
+        if length > MAX_BODY_SIZE:
+            raise ValueError('Request body is too large')
+
+        body = await reader.readexactly(length) if length else b''
+
+        return method, target, headers, body
+
+    @staticmethod
+    def _serialize(response, keep_alive):
+        body = response.body
+
+        if hasattr(body, 'read'):
+            content = body.read()
+            body.close()
+            body = content
+        elif isinstance(body, str):
+            body = body.encode('utf-8')
+
+        lines = ['HTTP/1.1 %s' % response.status_line]
+        lines += ['%s: %s' % (name, value) for name, value in response.headerlist
+                  if name.lower() not in ('content-length', 'connection')]
+        lines += ['Content-Length: %s' % len(body), 'Connection: %s' % ('keep-alive' if keep_alive else 'close')]
+
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+def run(host='0.0.0.0', port=8080, workers=DEFAULT_WORKERS):
+    # The workers are forked from us, so they start out with everything we've warmed up
+    warm_up()
+
+    print('Serving on %s:%s with %s move workers' % (host, port, workers))
+    asyncio.get_event_loop().run_until_complete(AsyncServer(workers).serve_forever(host, port))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the snake asynchronously, working out moves in processes.')
+    parser.add_argument('--host', default=os.getenv('IP', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '8080')))
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    args = parser.parse_args()
+
+    run(args.host, args.port, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+import argparse
+import contextlib
+import os
+import random
+import time
+
+from app.constants import DIRECTION_MAP
+from app.context import Context
+from app.mover import Mover
+from app.utility import add_coords
+
+# Standard rules
+START_LENGTH = 3
+START_HEALTH = 100
+MIN_FOOD = 1
+FOOD_SPAWN_CHANCE = 0.15
+
+# Games that go on longer than this are called a draw
+DEFAULT_MAX_TURNS = 500
+
+# Turn a direction back into a coord delta
+DIRECTION_DELTAS = dict((direction, delta) for delta, direction in DIRECTION_MAP.items())
+
+
+class SimulatedSnake(object):
+    def __init__(self, snake_id, dna, traits, start_coord):
+        self.id = snake_id
+        self.dna = dna
+        self.traits = traits
+        self.name = '%s (%s/%s)' % (snake_id, dna or 'default', traits or 'none')
+        self.health = START_HEALTH
+        self.body = [start_coord] * START_LENGTH
+
+        self.death = None  # Why the snake died, if it has
+        self.turns = 0  # How many turns the snake survived
+        self.move_times = []  # How long each move took to work out, in seconds
+
+    def to_point_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'health': self.health,
+            'body': [{'x': x, 'y': y} for x, y in self.body]
+        }
+
+
+class GameResult(object):
+    def __init__(self, game_id, snakes, turns):
+        self.game_id = game_id
+        self.snakes = snakes
+        self.turns = turns
+
+        survivors = [snake for snake in snakes if not snake.death]
+        self.winner = survivors[0] if len(survivors) == 1 else None
+
+
+class Simulator(object):
+    """
+    Plays whole games in process, with every snake moved by our own Mover, so we can
+    measure win rates and move times without a game engine or any HTTP.
+    """
+
+    def __init__(self, width=11, height=11, max_turns=DEFAULT_MAX_TURNS, time_budget=None):
+        self.width = width
+        self.height = height
+        self.max_turns = max_turns
+        self.time_budget = time_budget  # Seconds each snake gets per move, or None for no limit
+
+    def play(self, snake_configs, seed=0, game_id=None):
+        # type: (list, int, str) -> GameResult
+        """
+        Plays a game to the end.
+        :param snake_configs: (dna, traits) strings for each snake, as they'd appear in the URL.
+        :param seed: Seed for start positions, food and any random moves, so games can be replayed.
+        :param game_id: Game id to send to the snakes.
+        :return: Result of the game.
+        """
+        rng = random.Random(seed)
+        game_id = game_id or 'sim-%s' % seed
+
+        # Mover breaks ties with the random module, so seed that too
+        random.seed(seed)
+
+        start_coords = rng.sample([(x, y) for x in range(1, self.width - 1) for y in range(1, self.height - 1)],
+                                  len(snake_configs))
+        snakes = [SimulatedSnake(str(index), dna, traits, start_coord)
+                  for index, ((dna, traits), start_coord) in enumerate(zip(snake_configs, start_coords))]
+        food = []
+
+        for _ in snake_configs:
+            self._spawn_food(rng, snakes, food)
+
+        turn = 0
+        living = list(snakes)
+
+        # Keep the per-move logging quiet, there's a lot of it
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            while living and turn < self.max_turns and (len(living) > 1 or len(snakes) == 1):
+                moves = [(snake, self._get_move(game_id, turn, snake, living, food)) for snake in living]
+
+                for snake, direction in moves:
+                    snake.body.insert(0, add_coords(snake.body[0], DIRECTION_DELTAS[direction]))
+                    snake.body.pop()
+                    snake.health -= 1
+
+                # Every snake that gets to a piece of food eats it, even when they get there at the same time
+                eaten = set(snake.body[0] for snake in living if snake.body[0] in food)
+
+                for snake in living:
+                    if snake.body[0] in eaten:
+                        snake.health = START_HEALTH
+                        snake.body.append(snake.body[-1])
+
+                food[:] = [coord for coord in food if coord not in eaten]
+
+                if len(food) < MIN_FOOD or rng.random() < FOOD_SPAWN_CHANCE:
+                    self._spawn_food(rng, living, food)
+
+                turn += 1
+
+                for snake, death in [(snake, self._get_death(snake, living)) for snake in living]:
+                    if death:
+                        snake.death = death
+
+                living = [snake for snake in living if not snake.death]
+
+                for snake in living:
+                    snake.turns = turn
+
+        return GameResult(game_id, snakes, turn)
+
+    def _get_move(self, game_id, turn, snake, living, food):
+        data = {
+            'game': {'id': game_id},
+            'turn': turn,
+            'board': {
+                'width': self.width,
+                'height': self.height,
+                'food': [{'x': x, 'y': y} for x, y in food],
+                'snakes': [living_snake.to_point_dict() for living_snake in living]
+            },
+            'you': snake.to_point_dict()
+        }
+
+        started = time.time()
+
+        context = Context(data, snake.dna, snake.traits)
+        direction = Mover(context).next_move(started + self.time_budget if self.time_budget else None)
+
+        snake.move_times.append(time.time() - started)
+
+        return direction
+
+    def _get_death(self, snake, living):
+        head = snake.body[0]
+
+        if snake.health <= 0:
+            return 'starvation'
+
+        if not (0 <= head[0] < self.width and 0 <= head[1] < self.height):
+            return 'wall'
+
+        if head in snake.body[1:]:
+            return 'self collision'
+
+        for other in living:
+            if other is snake:
+                continue
+
+            if head in other.body[1:]:
+                return 'body collision'
+
+            if head == other.body[0] and len(snake.body) <= len(other.body):
+                return 'head collision'
+
+        return None
+
+    def _spawn_food(self, rng, snakes, food):
+        occupied = set(coord for snake in snakes for coord in snake.body) | set(food)
+        empty = [(x, y) for x in range(self.width) for y in range(self.height) if (x, y) not in occupied]
+
+        if empty:
+            food.append(rng.choice(empty))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] if ordered else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play games between snakes locally, without a game engine.')
+    parser.add_argument('snakes', nargs='+', metavar='DNA/TRAITS',
+                        help='A snake to play, as it would appear in the URL (e.g. "/agg" or "10-500/agg-opp")')
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--width', type=int, default=11)
+    parser.add_argument('--height', type=int, default=11)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-turns', type=int, default=DEFAULT_MAX_TURNS)
+    args = parser.parse_args()
+
+    snake_configs = [tuple(snake.split('/', 1)) if '/' in snake else ('', snake) for snake in args.snakes]
+    simulator = Simulator(args.width, args.height, args.max_turns)
+    wins = [0] * len(snake_configs)
+    move_times = []
+    started = time.time()
+
+    for game in range(args.games):
+        result = simulator.play(snake_configs, seed=args.seed + game)
+
+        if result.winner:
+            wins[int(result.winner.id)] += 1
+
+        move_times.extend(move_time for snake in result.snakes for move_time in snake.move_times)
+
+    elapsed = time.time() - started
+
+    for index, (dna, traits) in enumerate(snake_configs):
+        print('%s/%s won %s of %s games' % (dna or 'default', traits or 'none', wins[index], args.games))
+
+    print('%s games in %.1fs, move times p50 %.1fms, p95 %.1fms, p99 %.1fms' % (
+        args.games, elapsed, percentile(move_times, 0.5) * 1000, percentile(move_times, 0.95) * 1000,
+        percentile(move_times, 0.99) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,76 @@
-from app.utility import point_to_coord
+from collections import deque
 
 
 class Snake(object):
-    def __init__(self, data):
+    """
+    A snake's body runs head first, and stacked segments (after eating) are separate entries,
+    so the head, tail and length are kept up to date as the body changes rather than worked out again.
+    """
+
+    __slots__ = ('id', 'name', 'health', 'body', 'length', 'head', 'tail')
+
+    def __init__(self, data, geometry=None):
         self.id = data['id']
         self.name = data['name']
         self.health = data['health']
-        self.body = [point_to_coord(point) for point in data['body']]
+
+        # Snakes on a board are always in bounds, so their segments can share the geometry's coords
+        # rather than each being a new tuple
+        if geometry:
+            coords = geometry.coords
+            width = geometry.width
+            self.body = deque(coords[point['y'] * width + point['x']] for point in data['body'])
+        else:
+            self.body = deque((point['x'], point['y']) for point in data['body'])
+
         self.length = len(self.body)
         self.head = self.body[0]
         self.tail = self.body[-1]
 
-    def moved(self, coord, ate=False):
+    # Moves the head into a coord and drops the tail, returning the tail that was dropped
+    def move(self, coord):
+        tail = self.body.pop()
+
+        self.body.appendleft(coord)
         self.head = coord
-        self.body.insert(0, self.head)
-        self.body.remove(self.tail)
         self.tail = self.body[-1]
 
+        return tail
+
+    # Puts a tail back on, and takes the head off, to undo a move
+    def unmove(self, tail):
+        self.body.popleft()
+        self.body.append(tail)
+
+        self.head = self.body[0]
+        self.tail = tail
+
+    # Stacks another segment on the tail, like the snake does when it eats
+    def grow(self):
+        self.body.append(self.tail)
+        self.length += 1
+
+    def shrink(self):
+        self.body.pop()
+        self.length -= 1
+        self.tail = self.body[-1]
+
+    # Returns what's needed to undo the move
+    def moved(self, coord, ate=False):
+        undo = (self.move(coord), self.health, ate)
+
+        if ate:
+            self.grow()
+
+        self.health = 100 if ate else self.health - 1
+
+        return undo
+
+    def unmoved(self, undo):
+        tail, health, ate = undo
+
         if ate:
-            self.body.append(self.tail)
+            self.shrink()
+
+        self.unmove(tail)
+        self.health = health
@@ -0,0 +1,80 @@
+from array import array
+
+# Owner of cells that no snake can reach, and of cells that snakes of the same length reach at the same time
+UNCLAIMED = 0
+CONTESTED = 255
+
+
+class Territory(object):
+    """
+    Which snake can get to each cell first, from a single breadth first search out from every head at once.
+    When snakes reach a cell at the same time the longest one gets it, since it would win the collision,
+    and snakes of the same length leave it contested. Body segments block the search until they've moved on,
+    so cells are only claimed once they'll be free by the time a snake gets there.
+    Owners are numbered the same way as the context's grid.
+    """
+
+    def __init__(self, context):
+        grid = context.grid
+        geometry = grid.geometry
+        neighbors = geometry.neighbors
+        lengths = grid.lengths
+
+        self.grid = grid
+        self.owner = bytearray(geometry.size)
+        self.distance = array('i', [-1]) * geometry.size
+
+        frontier = []
+
+        for snake in context.board.snakes:
+            if not grid.in_bounds(snake.head):
+                continue
+
+            head = grid.index(snake.head)
+            number = grid.numbers[snake.id]
+
+            self.owner[head] = number
+            self.distance[head] = 0
+            frontier.append((head, number))
+
+        depth = 0
+
+        while frontier:
+            depth += 1
+            claims = {}
+
+            for index, number in frontier:
+                for neighbor in neighbors[index]:
+                    if self.distance[neighbor] != -1 or grid.vacates_at(neighbor) > depth:
+                        continue
+
+                    claim = claims.get(neighbor)
+
+                    if claim is None or lengths[number] > claim[0]:
+                        claims[neighbor] = (lengths[number], number)
+                    elif lengths[number] == claim[0] and number != claim[1]:
+                        claims[neighbor] = (claim[0], CONTESTED)
+
+            frontier = []
+
+            for index, (length, number) in claims.items():
+                self.owner[index] = number
+                self.distance[index] = depth
+
+                # Nobody gets past a contested cell without a collision
+                if number != CONTESTED:
+                    frontier.append((index, number))
+
+    def owns(self, snake, coord):
+        return self.owner[self.grid.index(coord)] == self.grid.numbers[snake.id]
+
+    def distance_to(self, coord):
+        # type: (tuple) -> int
+        """
+        :return: Moves it takes the closest snake to get to a coord, or None if none can.
+        """
+        distance = self.distance[self.grid.index(coord)]
+        return distance if distance != -1 else None
+
+    def size(self, snake):
+        return self.owner.count(self.grid.numbers[snake.id])
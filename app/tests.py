@@ -1,10 +1,41 @@
+import asyncio
+import contextlib
+import io
 import json
+import os
+import random
+import shutil
 import string
+import tempfile
+import time
 
 import unittest
+from concurrent.futures import ProcessPoolExecutor
+import bottle
 from boddle import boddle
 
-from app import main
+from app import geometry, main, metrics, transposition
+from app.api import read_json
+from app.batch import move_group
+from app.benchmark import find_regressions, generate_move_request, run as run_benchmark
+from app.bitboard import count, get_masks
+from app.context import Context
+from app.games import GameCache, games
+from app.grid import OccupancyGrid
+from app.mover import Mover
+from app.opponents import OpponentModel, observe_moves
+from app.pathfinder import PathFinder
+from app.rollout import BATCH_SIZE, RolloutSelector
+from app.server import AsyncServer
+from app.search import rebuild_timed_path
+from app.simulator import Simulator
+from app.snake import Snake
+from app.territory import CONTESTED, Territory
+from app.tuner import Tuner
+from app.transposition import TranspositionTable, Zobrist
+from app.constants import DIRECTION_MAP, OPPORTUNISTIC
+from app.utility import get_absolute_distance, get_adjacent_coords, get_coord_neighbors, is_adjacent_to_coords, \
+    sub_coords
 
 
 class TestIt(unittest.TestCase):
@@ -36,6 +67,27 @@ class TestIt(unittest.TestCase):
             move_response = main.move()
             self.assertEqual('{"move": "right"}', move_response.body)
 
+    def testMoveOutOfTime(self):
+        move_request = self.generateMoveRequest(
+                """
+                ________
+                ________
+                Y_______
+                0_______
+                y_______
+                ________
+                ________
+                ________
+                """
+        )
+
+        # Leave no time for anything but the safest move
+        move_request['game']['timeout'] = main.RESPONSE_MARGIN
+
+        with boddle(json=move_request):
+            move_response = main.move(traits="ins-cal")
+            self.assertEqual('{"move": "right"}', move_response.body)
+
     def testMoveEnemy(self):
         with boddle(json=self.generateMoveRequest(
                 """
@@ -48,6 +100,78 @@ class TestIt(unittest.TestCase):
             move_response = main.move()
             self.assertNotEqual('{"move": "up"}', move_response.body)
 
+    def testBatchMove(self):
+        enemy_request = self.generateMoveRequest(
+                """
+                _A1a
+                _Y__
+                _0__
+                _y__
+                """
+        )
+
+        # The enemy is one of our snakes too, in the same game and turn
+        their_request = json.loads(json.dumps(enemy_request))
+        their_request['you'] = next(snake for snake in their_request['board']['snakes'] if snake['id'] == '1')
+        their_request['traits'] = 'agg'
+
+        self.setUp()
+        corner_request = self.generateMoveRequest(
+                """
+                Y___
+                0___
+                y___
+                ____
+                """
+        )
+        corner_request['game']['id'] = 'game2'
+
+        with boddle(json=[enemy_request, their_request, corner_request]):
+            moves = json.loads(main.batch().body)['moves']
+
+        self.assertEqual(3, len(moves))
+        self.assertNotEqual('up', moves[0])
+        self.assertIn(moves[1], ['up', 'down', 'left', 'right'])
+        self.assertEqual('right', moves[2])
+
+    def testBatchRemembersGames(self):
+        request = self.generateMoveRequest(
+                """
+                ____
+                _Y__
+                _0__
+                _y__
+                """
+        )
+        request['game']['id'] = 'batch-history'
+        move_group([(0, '', '', request)])
+
+        request['turn'] += 1
+        request['you']['body'] = [{'x': 1, 'y': 0}] + request['you']['body'][:-1]
+        move_group([(0, '', '', request)])
+
+        # Batches see what snakes have done earlier in the game, the same as single moves
+        self.assertEqual(1, games.history(request)['0'].straight)
+        games.end(request)
+
+    def testBatchGroupSharesOutTime(self):
+        snakes = [{'id': str(number), 'name': 'test-%s' % number, 'health': 90,
+                   'body': [{'x': 2 * number + 1, 'y': y} for y in range(5, 8)]} for number in range(4)]
+        group = [(number, '', 'cal', {'game': {'id': 'batch-time'}, 'turn': 5, 'you': snake,
+                                      'board': {'width': 11, 'height': 11, 'food': [], 'snakes': snakes}})
+                 for number, snake in enumerate(snakes)]
+        output = io.StringIO()
+
+        # Not enough time for every snake's search to use its whole budget, one after another
+        with contextlib.redirect_stdout(output):
+            moves = move_group(group, time.time() + 0.3)
+
+        self.assertEqual([0, 1, 2, 3], [index for index, _ in moves])
+        self.assertEqual(4, output.getvalue().count('because it is Calculating ('))
+
+        for _, _, _, data in group:
+            games.end(data)
+
     def testMoveAvoidTrap(self):
         with boddle(json=self.generateMoveRequest(
                 """
@@ -272,6 +396,53 @@ class TestIt(unittest.TestCase):
             move_response = main.move()
             self.assertEqual('{"move": "down"}', move_response.body)
 
+    def testMoveCalculatingAvoidEnemyHead(self):
+        with boddle(json=self.generateMoveRequest(
+                """
+                __A1
+                _Y0a
+                __y_
+                ____
+                """
+        )):
+            move_response = main.move(traits="cal")
+            # Left and down are both safe, left keeps more of the board to ourselves
+            self.assertIn(move_response.body, ['{"move": "down"}', '{"move": "left"}'])
+
+    def testMoveSpeculativeAvoidEnemyHead(self):
+        with boddle(json=self.generateMoveRequest(
+                """
+                __A1
+                _Y0a
+                __y_
+                ____
+                """
+        )):
+            move_response = main.move(traits="spe")
+            self.assertIn(move_response.body, ['{"move": "down"}', '{"move": "left"}'])
+
+    def testRolloutsAreReproducible(self):
+        context = Context(self.generateMoveRequest(
+                """
+                __A1
+                _Y0a
+                __y_
+                ____
+                """
+        ), '', '')
+
+        selector = RolloutSelector(context, max_batches=2)
+        best = selector.best_move()
+        self.assertEqual(2 * BATCH_SIZE, selector.stats[(0, 1)][0])
+
+        # The same batches play out the same way, wherever they're played
+        self.assertEqual(best, RolloutSelector(context, max_batches=2).best_move())
+
+        with ProcessPoolExecutor(2) as pool:
+            pooled = RolloutSelector(context, time_budget=10, pool=pool, max_batches=2)
+            self.assertEqual(best, pooled.best_move())
+            self.assertEqual(selector.stats, pooled.stats)
+
     def testMoveTargetLatestBodySegment(self):
         with boddle(json=self.generateMoveRequest(
                 """
@@ -299,6 +470,561 @@ class TestIt(unittest.TestCase):
         # TODO add trapped tail test
         # TODO add food when starving and trapped test
 
+    def testFloodFillSizesMatchFloodFill(self):
+        pathfinder = PathFinder(Context(self.generateMoveRequest(
+                """
+                _0000__Y0_
+                00__000_0_
+                0_____0_00
+                0_____0__0
+                0_____00_0
+                0__y0__0_0
+                0___0000_0
+                0__000__00
+                00_0_0000_
+                _000______
+                """
+        ), '', ''))
+
+        for max_fill_size in [None, 5, pathfinder.context.me.length * 2]:
+            fill_sizes = pathfinder.flood_fill_sizes(pathfinder.valid_moves(), max_fill_size)
+            self.assertEqual(dict((move, len(pathfinder.flood_fill(move, max_fill_size)))
+                                  for move in pathfinder.valid_moves()), fill_sizes)
+
+    def testPathToCoordMatchesCostMap(self):
+        pathfinder = PathFinder(Context(self.generateMoveRequest(
+                """
+                _______________
+                __________y0_00
+                ___________0000
+                ______________0
+                ______________0
+                ______________0
+                _____________00
+                ________000000_
+                ________0_____X
+                ________0______
+                ________0______
+                ________0000___
+                ___________00__
+                ____________00X
+                _______X__X__Y_
+                """
+        ), '', ''))
+
+        head = pathfinder.context.me.head
+        for target in pathfinder.context.board.food + [(0, 0), (14, 0), pathfinder.context.me.tail]:
+            path = pathfinder.get_path_to_coord(head, target)
+            mapped_path = pathfinder.get_mapped_path_to_coord(head, target)
+            self.assertAlmostEqual(mapped_path[0], path[0])
+            self.assertEqual(path[1][0], head)
+            self.assertEqual(path[1][-1], target)
+
+    def testTerritory(self):
+        context = Context(self.generateMoveRequest(
+                """
+                Y___A
+                0___1
+                y___1
+                ____a
+                _____
+                """
+        ), '', '')
+        enemy = context.enemy_snakes()[0]
+        territory = Territory(context)
+
+        self.assertTrue(territory.owns(context.me, (1, 0)))
+        self.assertTrue(territory.owns(enemy, (3, 0)))
+        self.assertEqual(3, territory.distance_to((2, 1)))
+
+        # The enemy is longer, so it gets cells we'd reach at the same time
+        self.assertTrue(territory.owns(enemy, (2, 0)))
+
+        # Our tail has moved on by the time the enemy could get there, but we're closer
+        self.assertTrue(territory.owns(context.me, (0, 2)))
+        self.assertEqual(context.grid.width * context.grid.height,
+                         territory.size(context.me) + territory.size(enemy) + territory.owner.count(CONTESTED))
+
+    def testOpponentModel(self):
+        request = self.generateMoveRequest(
+                """
+                ______
+                X_A___
+                __1___
+                __a___
+                ______
+                Y0y___
+                """
+        )
+        request['board']['snakes'][0]['health'] = 10
+        context = Context(request, '', '')
+        enemy = context.enemy_snakes()[0]
+
+        # Hungry snakes go for food
+        chances = OpponentModel(context).move_chances(enemy)
+        self.assertEqual([(1, 1), (2, 0), (3, 1)], sorted(coord for chance, coord in chances))
+        self.assertAlmostEqual(1, sum(chance for chance, coord in chances))
+        self.assertEqual((1, 1), chances[0][1])
+
+        # Until we've seen that this one doesn't
+        observe_moves(context.history, {enemy.id: [(2, 2), (2, 3), (2, 4)]}, [(0, 1)], context.board)
+        self.assertEqual((1, 1, 1, 1), (context.history[enemy.id].moves, context.history[enemy.id].straight,
+                                        context.history[enemy.id].food_moves, context.history[enemy.id].toward_food))
+
+        context.history[enemy.id].straight = context.history[enemy.id].moves = 10
+        context.history[enemy.id].food_moves = 10
+        context.history[enemy.id].toward_food = 0
+        opponents = OpponentModel(context)
+        chance, coord = opponents.move_chances(enemy)[0]
+
+        self.assertEqual((2, 0), coord)
+        self.assertEqual(chance, opponents.danger_at((2, 0)))
+        self.assertEqual(0, opponents.danger_at((2, 2)))
+
+    def testEarliestArrivals(self):
+        context = Context(self.generateMoveRequest(
+                """
+                _Y0_
+                __0_
+                __y_
+                ____
+                """
+        ), '', '')
+        pathfinder = PathFinder(context)
+        geometry = context.grid.geometry
+        earliest, layers = pathfinder.get_arrivals(context.me.head)
+
+        # Our body opens up behind us as we move
+        self.assertEqual(2, earliest[geometry.index((2, 1))])
+        self.assertEqual(3, earliest[geometry.index((2, 0))])
+        self.assertEqual(4, earliest[geometry.index((3, 0))])
+        self.assertEqual([(1, 0), (1, 1), (2, 1), (2, 0)],
+                         [geometry.coords[index] for index in rebuild_timed_path(layers, geometry.index((2, 0)), 3)])
+
+        # Next to the segment before our tail, no sooner than it's about to move on
+        cost, path = pathfinder.get_timed_path_next_to(context.me.head, (2, 1), 2)
+        self.assertEqual(4, len(path))
+        self.assertIn(path[-1], [(2, 0), (1, 1), (3, 1), (2, 2)])
+
+    def testTimedPathsDontGoBackThroughOurBody(self):
+        body = [(2, 2), (2, 3), (3, 3), (4, 3), (5, 3), (5, 2), (5, 1), (4, 1), (3, 1), (2, 1), (1, 1),
+                (1, 2), (1, 3), (1, 4), (2, 4), (3, 4), (4, 4), (5, 4), (6, 4), (6, 3), (6, 2)]
+        you = {'id': 'you', 'name': 'you', 'health': 100, 'body': [{'x': x, 'y': y} for x, y in body]}
+        context = Context({'game': {'id': 'game1'}, 'turn': 1, 'you': you,
+                           'board': {'width': 7, 'height': 7, 'food': [], 'snakes': [you]}}, '', '')
+        mover = Mover(context)
+        geometry = context.grid.geometry
+        earliest, layers = mover.pathfinder.get_arrivals(context.me.head)
+
+        # We're coiled around a two cell pocket, which we can only go into and die
+        self.assertTrue(mover.pathfinder.is_trapped())
+        self.assertEqual(3, len(layers))
+        self.assertEqual(2, earliest[geometry.index((4, 2))])
+        self.assertIsNone(mover._get_path_to_body_segment_closest_to_tail([context.me]))
+
+    def testTimedPathsNeverRevisitTheirTrail(self):
+        rng = random.Random(7)
+
+        for _ in range(100):
+            # A longer enemy keeps us looking ahead for more turns than we're long
+            me = self.generateRandomBody(rng, 6, rng.randrange(3, 8), [])
+            enemy = self.generateRandomBody(rng, 6, rng.randrange(10, 20), me)
+            you = {'id': 'you', 'name': 'you', 'health': 100, 'body': [{'x': x, 'y': y} for x, y in me]}
+            other = {'id': 'other', 'name': 'other', 'health': 100, 'body': [{'x': x, 'y': y} for x, y in enemy]}
+            context = Context({'game': {'id': 'game1'}, 'turn': 1, 'you': you,
+                               'board': {'width': 6, 'height': 6, 'food': [], 'snakes': [you, other]}}, '', '')
+            earliest, layers = PathFinder(context).get_arrivals(context.me.head)
+
+            for turn in range(1, len(layers)):
+                for index in layers[turn]:
+                    path = rebuild_timed_path(layers, index, turn)
+
+                    # Cells stay under our body until we've moved our length past them
+                    for start in range(len(path)):
+                        self.assertNotIn(path[start], path[start + 1:start + len(me)])
+
+    def testGeometryMatchesUtility(self):
+        table = geometry.get_geometry(4, 6)
+
+        for coord in table.coords:
+            index = table.index(coord)
+            neighbors = [neighbor for neighbor in get_coord_neighbors(coord) if table.in_bounds(neighbor)]
+
+            self.assertEqual(neighbors, list(table.neighbor_coords[index]))
+
+            for neighbor in neighbors:
+                self.assertEqual(DIRECTION_MAP[sub_coords(neighbor, coord)], table.direction(coord, neighbor))
+
+            for other in table.coords:
+                self.assertEqual(get_absolute_distance(coord, other), table.distance(index, table.index(other)))
+
+        self.assertIsNone(table.direction((0, 0), (1, 1)))
+
+    def testBitboardMatchesUtility(self):
+        masks = get_masks(5, 7)
+        coords = [(x, y) for y in range(7) for x in range(5)]
+        some_coords = coords[::3]
+        some_bits = masks.bits(some_coords)
+
+        for coord in coords:
+            neighbors = [neighbor for neighbor in get_coord_neighbors(coord) if neighbor in coords]
+            self.assertEqual(sorted(neighbors), sorted(masks.coords(masks.neighbors(masks.bit(coord)))))
+            self.assertEqual(sorted(get_adjacent_coords(coord, some_coords)),
+                             sorted(masks.coords(masks.neighbors(masks.bit(coord)) & some_bits)))
+            self.assertEqual(is_adjacent_to_coords(coord, some_coords), masks.is_adjacent_to_any(coord, some_bits))
+
+    def testBitboardFloodFillMatchesPathFinder(self):
+        context = Context(self.generateMoveRequest(
+                """
+                ___1___
+                _A11___
+                _a_____
+                _Y0000_
+                _____0_
+                __y000_
+                _______
+                """
+        ), '', '')
+        pathfinder = PathFinder(context)
+        masks = get_masks(7, 7)
+        fatal = masks.bits(pathfinder.fatal_coords())
+        self.assertEqual(fatal, masks.from_flags(pathfinder._fatal_mask()))
+
+        for coord in context.grid.geometry.coords:
+            start_bit = masks.bit(coord)
+            self.assertEqual(len(pathfinder.flood_fill(coord)), count(masks.flood_fill(start_bit, fatal & ~start_bit)))
+
+            # Bitboard fills go a whole frontier at a time, so they get to at least every cell the
+            # depth first fill does by the same depth
+            within_depth = masks.flood_fill(start_bit, fatal & ~start_bit, 2)
+            filled = masks.bits(fill_coord for fill_coord, depth in pathfinder.flood_fill(coord, max_depth=2))
+            self.assertEqual(filled, filled & within_depth)
+
+    def testApplyAndUndoMove(self):
+        context = Context(self.generateMoveRequest(
+                """
+                ____
+                X_Yy
+                __00
+                ____
+                """
+        ), '', '')
+
+        body = list(context.me.body)
+        occupant = bytearray(context.grid.occupant)
+
+        with context.moved((1, 1)):
+            self.assertEqual([(1, 1)] + body[:-1], list(context.me.body))
+            self.assertEqual(99, context.me.health)
+            self.assertEqual([(0, 1)], context.board.food)
+            self.assertTrue(context.grid.is_occupied((1, 1)))
+
+            with context.moved((0, 1)):
+                self.assertEqual([(0, 1), (1, 1)] + body[:-2] + [body[-3]], list(context.me.body))
+                self.assertEqual([], context.board.food)
+                self.assertEqual(100, context.me.health)
+                self.assertEqual(len(body) + 1, context.me.length)
+
+        self.assertEqual(body, list(context.me.body))
+        self.assertEqual(100, context.me.health)
+        self.assertEqual([(0, 1)], context.board.food)
+        self.assertEqual(occupant, context.grid.occupant)
+
+    def testSnakeMoveGrowShrink(self):
+        snake = Snake({'id': 'a', 'name': 'a', 'health': 50, 'body': [{'x': 1, 'y': 0}, {'x': 0, 'y': 0}] +
+                       [{'x': 0, 'y': 1}] * 2})
+
+        self.assertEqual(((1, 0), (0, 1), 4), (snake.head, snake.tail, snake.length))
+
+        # Only one of the stacked tail segments goes
+        self.assertEqual((0, 1), snake.move((2, 0)))
+        self.assertEqual([(2, 0), (1, 0), (0, 0), (0, 1)], list(snake.body))
+
+        snake.grow()
+        self.assertEqual(((0, 1), 5), (snake.tail, snake.length))
+
+        snake.shrink()
+        snake.unmove((0, 1))
+        self.assertEqual([(1, 0), (0, 0), (0, 1), (0, 1)], list(snake.body))
+        self.assertEqual(((1, 0), (0, 1), 4), (snake.head, snake.tail, snake.length))
+
+        with self.assertRaises(AttributeError):
+            snake.extra = True
+
+    def testStartAndEndAlwaysRespond(self):
+        for body in ['', 'null', 'not json', '{}', '{"game": {"id": "game1"}}', '{"game": null, "you": {"id": "you"}}']:
+            with boddle(body=body):
+                self.assertEqual(200, main.start().status_code)
+                self.assertEqual(200, main.end().status_code)
+
+        started = GameCache()
+        started.start({'game': {'id': 'game1'}, 'you': {'id': 'you'}})
+        started.end({'game': {'id': 'game1'}})
+
+        self.assertEqual(1, len(started))
+
+    def testGameCacheMovesGridAlong(self):
+        move_request = self.generateMoveRequest(
+                """
+                ____
+                X_Yy
+                __00
+                ____
+                """
+        )
+        games = GameCache()
+        games.start(move_request)
+        grids = set()
+
+        for turn, head, food in [(1, None, [(0, 1)]), (2, (1, 1), [(0, 1)]), (3, (0, 1), []), (4, (0, 2), [])]:
+            body = [(point['x'], point['y']) for point in move_request['you']['body']]
+            if head:
+                body = [head] + body[:-1] + (body[-2:-1] if head == (0, 1) else [])
+
+            move_request['turn'] = turn
+            move_request['you']['body'] = [{'x': x, 'y': y} for x, y in body]
+            move_request['board']['snakes'] = [move_request['you']]
+            move_request['board']['food'] = [{'x': x, 'y': y} for x, y in food]
+
+            context = Context(move_request, '', '', games)
+            grids.add(id(context.grid))
+            grid = OccupancyGrid(context.board)
+            self.assertEqual(grid.occupant, context.grid.occupant)
+            self.assertEqual([grid.vacates_at(index) for index in range(16)],
+                             [context.grid.vacates_at(index) for index in range(16)])
+
+        # The same grid was moved along every turn
+        self.assertEqual(1, len(grids))
+        self.assertIs(context.grid, games.get(move_request).grid)
+        games.end(move_request)
+        self.assertEqual(0, len(games))
+
+    def testTunerResumesFromCheckpoint(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'tuning.jsonl')
+
+        def tune(seed=1):
+            tuner = Tuner(seed=seed, population=2, games=1, width=7, height=7, opponents=[('', OPPORTUNISTIC)],
+                          processes=1, checkpoint_path=path)
+            loaded = len(tuner.results)
+            return loaded, tuner.run(2)
+
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                loaded, ranked = tune()
+                self.assertEqual(0, loaded)
+
+                # Stop partway through writing the last result
+                with open(path) as checkpoint:
+                    lines = checkpoint.readlines()
+
+                with open(path, 'w') as checkpoint:
+                    checkpoint.write(''.join(lines[:-1]) + lines[-1][:len(lines[-1]) // 2])
+
+                resumed, resumed_ranked = tune()
+
+                # Results from a different seed don't get mixed in
+                with self.assertRaises(ValueError):
+                    tune(seed=2)
+        finally:
+            shutil.rmtree(directory)
+
+        # Only the lost result was played again, and it came out the same
+        self.assertEqual(3, resumed)
+        self.assertEqual(4, len(resumed_ranked))
+        # Move times are the only thing that changes from run to run
+        self.assertEqual([dict(result, latency=None) for result in ranked],
+                         [dict(result, latency=None) for result in resumed_ranked])
+
+    def testBenchmarkRequestsRoundTrip(self):
+        data = generate_move_request(random.Random(3), 7, 3, 6, 4)
+
+        # The same seed always makes the same board
+        self.assertEqual(data, generate_move_request(random.Random(3), 7, 3, 6, 4))
+
+        with boddle(body=json.dumps(data)):
+            self.assertEqual(data, read_json(bottle.request))
+            self.assertIn(json.loads(main.move().body)['move'], ['up', 'down', 'left', 'right'])
+
+        context = Context(data, '', '')
+        coords = [coord for snake in context.board.snakes for coord in snake.body] + context.board.food
+
+        self.assertEqual(3, len(context.board.snakes))
+        self.assertEqual(4, len(context.board.food))
+        self.assertEqual(len(coords), len(set(coords)))
+        self.assertTrue(all(context.grid.in_bounds(coord) for coord in coords))
+
+        for snake in context.board.snakes:
+            self.assertTrue(all(get_absolute_distance(coord, next_coord) == 1
+                                for coord, next_coord in zip(list(snake.body), list(snake.body)[1:])))
+
+    def testBenchmarkFlagsSlowdowns(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'benchmark.json')
+
+        try:
+            results = run_benchmark(sizes=[7], snake_counts=[2], traits_list=[''], boards=2)
+
+            with open(path, 'w') as out:
+                json.dump(results, out)
+
+            with open(path) as saved:
+                baseline = json.load(saved)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(results, baseline)
+        self.assertEqual([], find_regressions(baseline, results))
+
+        scenario = '7x7/2 snakes/long/none'
+        slower = json.loads(json.dumps(results))
+        slower['scenarios'][scenario]['p95'] = baseline['scenarios'][scenario]['p95'] * 2 + 5
+        self.assertEqual([(scenario, baseline['scenarios'][scenario]['p95'], slower['scenarios'][scenario]['p95'])],
+                         find_regressions(baseline, slower))
+
+        # Slowdowns of less than a millisecond are noise
+        slower['scenarios'][scenario]['p95'] = baseline['scenarios'][scenario]['p95'] + 0.5
+        self.assertEqual([], find_regressions(baseline, slower))
+
+    def testTranspositionTable(self):
+        request = self.generateMoveRequest(
+                """
+                ____
+                X_Yy
+                __00
+                ____
+                """
+        )
+        context = Context(request, '', '')
+        zobrist = Zobrist()
+        start_hash = zobrist.hash_context(context)
+
+        with context.moved((1, 1)):
+            self.assertNotEqual(start_hash, zobrist.hash_context(context))
+
+        self.assertEqual(start_hash, zobrist.hash_context(context))
+        self.assertEqual(start_hash, zobrist.hash_context(Context(request, '', '')))
+
+        # The context's hash is kept up to date through moves, eating and undoing them
+        rng = random.Random(1)
+        context = Context(self.generateMoveRequest(
+                """
+                X_X___
+                _A1a_X
+                ______
+                _YX___
+                _00X__
+                __y___
+                """
+        ), '', '')
+        undo = []
+
+        for _ in range(30):
+            snake = rng.choice(context.board.snakes)
+            moves = [coord for coord in get_coord_neighbors(snake.head)
+                     if context.grid.in_bounds(coord) and coord not in snake.body]
+
+            if moves and rng.random() < 0.7:
+                undo.append(context.apply_move(snake, rng.choice(moves)))
+            elif undo:
+                context.undo_move(undo.pop())
+
+            self.assertEqual(transposition.zobrist.hash_context(context), context.hash)
+
+        table = TranspositionTable(max_entries=2)
+        table.put('deep', 1, depth=3)
+        table.put('deep', 2, depth=1)
+        self.assertEqual(1, table.get('deep'))
+        self.assertIsNone(table.get('deep', depth=4))
+
+        # The shallow entry goes first, even though the deep one is older
+        table.put('shallow', 3)
+        table.put('new', 4)
+        self.assertIsNone(table.get('shallow'))
+        self.assertEqual(1, table.get('deep'))
+        self.assertEqual((2, 2), (table.hits, table.misses))
+
+    def testSimulatedGamesAreReproducible(self):
+        simulator = Simulator(7, 7, max_turns=50)
+        results = [simulator.play([('', 'opp'), ('', 'agg')], seed=3) for _ in range(2)]
+
+        for result in results:
+            self.assertLessEqual(result.turns, 50)
+            self.assertTrue(result.winner or result.turns == 50 or all(snake.death for snake in result.snakes))
+            self.assertEqual(result.turns, max(len(snake.move_times) for snake in result.snakes))
+
+        self.assertEqual(results[0].turns, results[1].turns)
+        self.assertEqual([snake.body for snake in results[0].snakes], [snake.body for snake in results[1].snakes])
+
+    def testMetricsHistogram(self):
+        def hot_path():
+            pass
+
+        # Nothing gets wrapped when metrics are off
+        self.assertIs(hot_path, metrics.timed('test.hot_path')(hot_path) if not metrics.ENABLED else hot_path)
+
+        metrics.record('test.timing', 0.0002)
+        metrics.record('test.timing', 0.02)
+
+        with boddle():
+            text = main.get_metrics().body
+
+        self.assertIn('snake_timing_seconds_bucket{name="test.timing",le="0.0005"} 1', text)
+        self.assertIn('snake_timing_seconds_bucket{name="test.timing",le="+Inf"} 2', text)
+        self.assertIn('snake_timing_seconds_count{name="test.timing"} 2', text)
+
+        # Timings from other processes add up with ours
+        text = metrics.exposition(metrics.merge(metrics.snapshot(), metrics.snapshot()))
+        self.assertIn('snake_timing_seconds_bucket{name="test.timing",le="0.0005"} 2', text)
+        self.assertIn('snake_timing_seconds_count{name="test.timing"} 4', text)
+
+    def testAsyncServer(self):
+        move_request = json.dumps(self.generateMoveRequest(
+                """
+                Y___
+                0___
+                y___
+                ____
+                """
+        )).encode('utf-8')
+
+        async def request(address, method, path, body=b''):
+            reader, writer = await asyncio.open_connection(*address)
+            writer.write(('%s %s HTTP/1.1\r\nContent-Length: %s\r\nConnection: close\r\n\r\n' % (
+                method, path, len(body))).encode('latin-1') + body)
+            response = await reader.read()
+            writer.close()
+            return response
+
+        async def play():
+            server = AsyncServer(workers=1)
+            address = await server.start('127.0.0.1', 0)
+
+            try:
+                return await asyncio.gather(request(address, 'POST', '/move', move_request),
+                                            request(address, 'POST', '/opp/ping'),
+                                            request(address, 'GET', '/nowhere/to/be/found'),
+                                            request(address, 'GET', '/opp/metrics'))
+            finally:
+                await server.close()
+
+        loop = asyncio.new_event_loop()
+        move, ping, missing, timings = loop.run_until_complete(play())
+        loop.close()
+
+        self.assertTrue(move.startswith(b'HTTP/1.1 200 OK'))
+        self.assertTrue(move.endswith(b'{"move": "right"}'))
+        self.assertTrue(ping.startswith(b'HTTP/1.1 200 OK'))
+        self.assertTrue(missing.startswith(b'HTTP/1.1 404'))
+        self.assertTrue(timings.startswith(b'HTTP/1.1 200 OK'))
+        self.assertIn(b'# TYPE snake_timing_seconds histogram', timings)
+
+    def testWarmUpBuildsGeometry(self):
+        main.warm_up([5])
+
+        self.assertIn((5, 5), geometry._geometries)
+        self.assertEqual(25, geometry.get_geometry(5, 5).size)
+
     def generateMoveRequest(self, asciiBoard):
         moveRequest = {}
         self.addToil(moveRequest)
@@ -371,6 +1097,21 @@ class TestIt(unittest.TestCase):
             self.snakes[id]['body'] = []
         return self.snakes[id]
 
+    def generateRandomBody(self, rng, size, length, taken):
+        # A random walk from a random free cell, cut short if it runs out of room
+        body = [rng.choice([(x, y) for x in range(size) for y in range(size) if (x, y) not in taken])]
+
+        while len(body) < length:
+            moves = [coord for coord in get_coord_neighbors(body[-1])
+                     if 0 <= coord[0] < size and 0 <= coord[1] < size and coord not in body and coord not in taken]
+
+            if not moves:
+                break
+
+            body.append(rng.choice(moves))
+
+        return body
+
     def addToil(self, moveRequest):
         moveRequest['game'] = {'id': 'game1'}
         moveRequest['turn'] = 1
@@ -0,0 +1,119 @@
+import random
+from collections import OrderedDict
+from itertools import islice
+
+# Health is only hashed to the nearest bucket, so nearly identical positions still match
+HEALTH_BUCKET_SIZE = 10
+
+# Most entries we'll keep in the table, before evicting old ones
+# Tables only hold small results (fill sizes and scores), so this bounds their size too
+DEFAULT_MAX_ENTRIES = 20000
+
+# How many of the least recently used entries to look at when evicting, we drop the shallowest of them
+EVICTION_SAMPLE_SIZE = 4
+
+
+class Zobrist(object):
+    """
+    Zobrist hashing for board positions, where every feature of a position (a snake's head,
+    a step from one of its segments to the next, a piece of food) gets its own random number,
+    and a position's hash is all of its features' numbers XORed together.
+    A body is hashed as its head and the steps between its segments, rather than each segment and
+    how far down the body it is, so a move only changes a few features and the hash can be kept up to date.
+    """
+
+    def __init__(self, seed=0):
+        self._random = random.Random(seed)
+        self._keys = {}
+
+    def key(self, *feature):
+        key = self._keys.get(feature)
+
+        if key is None:
+            key = self._keys[feature] = self._random.getrandbits(64)
+
+        return key
+
+    # We care which snake we are, but enemies are interchangeable
+    @staticmethod
+    def role(context, snake):
+        return 'me' if snake is context.me else 'enemy'
+
+    # A snake's head, along with its length and health, which go with the head since no two snakes share one
+    def head_key(self, role, snake):
+        return self.key(role, snake.head, snake.length, snake.health // HEALTH_BUCKET_SIZE)
+
+    # A step from one segment to the next, stacked segments don't step anywhere
+    def step_key(self, role, coord, next_coord):
+        return self.key(role, coord, next_coord) if coord != next_coord else 0
+
+    def hash_context(self, context):
+        board = context.board
+        position_hash = self.key('size', board.width, board.height)
+
+        for snake in board.snakes:
+            role = self.role(context, snake)
+            position_hash ^= self.head_key(role, snake)
+
+            for coord, next_coord in zip(snake.body, islice(snake.body, 1, None)):
+                position_hash ^= self.step_key(role, coord, next_coord)
+
+        for coord in board.food:
+            position_hash ^= self.key('food', coord)
+
+        return position_hash
+
+
+class TranspositionTable(object):
+    """
+    Bounded cache of results for positions we've already seen, keyed by position hash.
+    Results searched to a greater depth are preferred when replacing and evicting entries.
+    Positions rarely come up again on a later move, so each move gets its own table.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, depth=0):
+        entry = self._entries.get(key)
+
+        if entry is None or entry[0] < depth:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+
+        return entry[1]
+
+    def put(self, key, value, depth=0):
+        entry = self._entries.get(key)
+
+        # Don't replace a deeper result with a shallower one
+        if entry is None or entry[0] <= depth:
+            self._entries[key] = (depth, value)
+
+        self._entries.move_to_end(key)
+
+        if len(self._entries) > self.max_entries:
+            self._evict()
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def _evict(self):
+        oldest = [key for key, _ in zip(self._entries, range(EVICTION_SAMPLE_SIZE))]
+        del self._entries[min(oldest, key=lambda oldest_key: self._entries[oldest_key][0])]
+
+
+# Shared by every request this process handles
+zobrist = Zobrist()
@@ -0,0 +1,241 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+
+from app.constants import *
+from app.simulator import Simulator, percentile
+
+# Traits the tuner can turn on and off
+# The lookahead trait searches until its time budget runs out, so games with it can't be replayed exactly
+TUNABLE_TRAITS = [OPPORTUNISTIC, AGGRESSIVE, GLUTTONOUS, INSECURE]
+
+# Snakes each candidate plays against, as (dna, traits)
+DEFAULT_OPPONENTS = [('', OPPORTUNISTIC), ('', '-'.join([AGGRESSIVE, OPPORTUNISTIC])), ('', INSECURE)]
+
+# Chance of each gene or trait changing when a candidate is mutated, and how far genes can move
+MUTATION_RATE = 0.3
+MUTATION_SCALE = 0.5
+
+
+class Candidate(object):
+    def __init__(self, generation, index, dna, traits):
+        self.generation = generation
+        self.index = index
+        self.dna = dna
+        self.traits = traits
+
+    def key(self):
+        return self.generation, self.index
+
+    def dna_string(self):
+        return '-'.join(str(gene) for gene in self.dna)
+
+    def traits_string(self):
+        return '-'.join(self.traits)
+
+
+def random_candidate(rng, generation, index):
+    dna = [max(0, int(round(gene * rng.uniform(1 - MUTATION_SCALE, 1 + MUTATION_SCALE)))) for gene in DEFAULT_DNA]
+    traits = [trait for trait in TUNABLE_TRAITS if rng.random() < 0.5]
+
+    return Candidate(generation, index, dna, traits)
+
+
+def mutated_candidate(rng, parent, generation, index):
+    dna = [max(0, int(round(gene * rng.uniform(1 - MUTATION_SCALE, 1 + MUTATION_SCALE))))
+           if rng.random() < MUTATION_RATE else gene for gene in parent['dna']]
+    traits = [trait for trait in TUNABLE_TRAITS
+              if (trait in parent['traits']) != (rng.random() < MUTATION_RATE / len(TUNABLE_TRAITS))]
+
+    return Candidate(generation, index, dna, traits)
+
+
+def evaluate(task):
+    # type: (tuple) -> dict
+    """
+    Plays a candidate's games. This runs in the worker processes.
+    :param task: Tuple of the candidate, games to play, base seed, board size and opponents.
+    :return: Result for the candidate.
+    """
+    candidate, games, seed, width, height, opponents = task
+    simulator = Simulator(width, height)
+
+    wins = 0
+    turns = 0
+    move_times = []
+
+    for game in range(games):
+        # Every candidate in a generation plays the same games, so they're compared fairly
+        result = simulator.play([(candidate.dna_string(), candidate.traits_string())] + opponents,
+                                seed=seed * 1000003 + candidate.generation * 1009 + game)
+        me = result.snakes[0]
+
+        wins += 1 if result.winner is me else 0
+        turns += me.turns
+        move_times.extend(me.move_times)
+
+    return {
+        'generation': candidate.generation,
+        'index': candidate.index,
+        'dna': candidate.dna,
+        'traits': candidate.traits,
+        'games': games,
+        'wins': wins,
+        # Winning matters most, but surviving longer counts for something
+        'fitness': (wins + 0.5 * turns / float(simulator.max_turns)) / games,
+        'latency': {
+            'p50': percentile(move_times, 0.5) * 1000,
+            'p95': percentile(move_times, 0.95) * 1000,
+            'max': max(move_times or [0]) * 1000
+        }
+    }
+
+
+class Tuner(object):
+    """
+    Searches for good DNA and traits by playing candidates against a fixed set of opponents,
+    either evolving the best candidates of each generation or trying new random ones.
+    Every result is appended to a checkpoint file as soon as it's in, so a run that's restarted
+    with the same settings picks up where it left off, and the same seed always tries the same candidates.
+    The checkpoint starts with the settings it was made with, and won't be resumed with any others.
+    """
+
+    def __init__(self, seed=0, population=16, games=10, width=11, height=11, strategy='evolve',
+                 opponents=DEFAULT_OPPONENTS, processes=None, checkpoint_path='tuning.jsonl'):
+        self.seed = seed
+        self.population = population
+        self.games = games
+        self.width = width
+        self.height = height
+        self.strategy = strategy
+        self.opponents = list(opponents)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.checkpoint_path = checkpoint_path
+
+        self.results = {}
+        self._load_checkpoint()
+
+    def run(self, generations):
+        pool = multiprocessing.Pool(self.processes)
+
+        try:
+            for generation in range(generations):
+                candidates = self._candidates(generation)
+                tasks = [(candidate, self.games, self.seed, self.width, self.height, self.opponents)
+                         for candidate in candidates if candidate.key() not in self.results]
+
+                with open(self.checkpoint_path, 'a') as checkpoint:
+                    for result in pool.imap_unordered(evaluate, tasks):
+                        self.results[(result['generation'], result['index'])] = result
+                        checkpoint.write(json.dumps(result) + '\n')
+                        checkpoint.flush()
+                        os.fsync(checkpoint.fileno())
+
+                best = self.ranked(generation)[0]
+                print('Generation %s best: %s/%s, fitness %.3f, p95 move %.1fms' % (
+                    generation, '-'.join(str(gene) for gene in best['dna']), '-'.join(best['traits']),
+                    best['fitness'], best['latency']['p95']))
+        finally:
+            pool.close()
+            pool.join()
+
+        return self.ranked()
+
+    def ranked(self, generation=None):
+        results = [result for result in self.results.values()
+                   if generation is None or result['generation'] == generation]
+
+        return sorted(results, key=lambda result: (-result['fitness'], result['generation'], result['index']))
+
+    def _candidates(self, generation):
+        # Each generation has its own random stream, so it comes out the same when resuming
+        rng = random.Random('%s-%s' % (self.seed, generation))
+
+        if generation == 0 or self.strategy == 'random':
+            return [random_candidate(rng, generation, index) for index in range(self.population)]
+
+        # Keep the best half of the last generation, and fill the rest with their mutations
+        parents = self.ranked(generation - 1)[:max(1, self.population // 2)]
+        candidates = [Candidate(generation, index, parent['dna'], parent['traits'])
+                      for index, parent in enumerate(parents)]
+
+        for index in range(len(candidates), self.population):
+            candidates.append(mutated_candidate(rng, rng.choice(parents), generation, index))
+
+        return candidates
+
+    # Everything that changes which candidates are tried, or how they do
+    def settings(self):
+        return {
+            'seed': self.seed,
+            'population': self.population,
+            'games': self.games,
+            'width': self.width,
+            'height': self.height,
+            'strategy': self.strategy,
+            'opponents': [list(opponent) for opponent in self.opponents]
+        }
+
+    def _load_checkpoint(self):
+        lines = []
+
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as checkpoint:
+                lines = checkpoint.read().split('\n')
+
+        # A crash can leave a half written last line, which we drop so new results start on a line of their own
+        if lines and lines[-1]:
+            with open(self.checkpoint_path, 'w') as checkpoint:
+                checkpoint.write(''.join(line + '\n' for line in lines[:-1]))
+
+        lines = lines[:-1]
+
+        if not lines:
+            with open(self.checkpoint_path, 'w') as checkpoint:
+                checkpoint.write(json.dumps({'settings': self.settings()}) + '\n')
+            return
+
+        settings = json.loads(lines[0]).get('settings')
+
+        # Results from other settings can't be compared with ours
+        if settings != self.settings():
+            raise ValueError('Checkpoint %s was made with %s, not %s' % (
+                self.checkpoint_path, json.dumps(settings), json.dumps(self.settings())))
+
+        for line in lines[1:]:
+            result = json.loads(line)
+            self.results[(result['generation'], result['index'])] = result
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune snake DNA and traits by playing games in parallel.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--generations', type=int, default=10)
+    parser.add_argument('--population', type=int, default=16)
+    parser.add_argument('--games', type=int, default=10, help='Games each candidate plays')
+    parser.add_argument('--width', type=int, default=11)
+    parser.add_argument('--height', type=int, default=11)
+    parser.add_argument('--strategy', choices=['evolve', 'random'], default='evolve')
+    parser.add_argument('--processes', type=int, default=None, help='Defaults to the number of cores')
+    parser.add_argument('--out', default='tuning.json', help='Where to write the ranked results')
+    parser.add_argument('--checkpoint', default=None,
+                        help='Where to keep results as they come in, to resume from (defaults to --out as .jsonl)')
+    args = parser.parse_args()
+
+    try:
+        tuner = Tuner(args.seed, args.population, args.games, args.width, args.height, args.strategy,
+                      processes=args.processes,
+                      checkpoint_path=args.checkpoint or os.path.splitext(args.out)[0] + '.jsonl')
+    except ValueError as error:
+        parser.error(str(error))
+    ranked = tuner.run(args.generations)
+
+    with open(args.out, 'w') as out:
+        json.dump(ranked, out, indent=2)
+
+    print('Wrote %s ranked candidates to %s' % (len(ranked), args.out))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,19 @@
 from app.constants import DIRECTION_MAP
 
+# Neighbors of every coord we've been asked about, since the same few coords come up over and over
+# Coords don't say what size board they're on, so these include neighbors off the edge of the board,
+# board sized lookups are in app/geometry.py
+_coord_neighbors = {}
+
 
 # Add two coord tuples together
 def add_coords(coord_one, coord_two):
-    return tuple(map(lambda x, y: x + y, coord_one, coord_two))
+    return coord_one[0] + coord_two[0], coord_one[1] + coord_two[1]
 
 
 # Find the difference between two coord tuples
 def sub_coords(coord_one, coord_two):
-    return tuple(map(lambda x, y: x - y, coord_one, coord_two))
+    return coord_one[0] - coord_two[0], coord_one[1] - coord_two[1]
 
 
 # Convert from x,y point dictionary to coord tuple
@@ -18,13 +23,17 @@ def point_to_coord(point):
 
 # Get the four neighboring squares for a given coord (up, down, left, right)
 def get_coord_neighbors(coord):
-    return [add_coords(coord, dir_coord) for dir_coord in DIRECTION_MAP.keys()]
+    neighbors = _coord_neighbors.get(coord)
+
+    if neighbors is None:
+        neighbors = _coord_neighbors[coord] = tuple(add_coords(coord, dir_coord) for dir_coord in DIRECTION_MAP)
+
+    return neighbors
 
 
 # Get absolute distance
 def get_absolute_distance(coord1, coord2):
-    diff = sub_coords(coord1, coord2)
-    return abs(diff[0]) + abs(diff[1])
+    return abs(coord1[0] - coord2[0]) + abs(coord1[1] - coord2[1])
 
 
 # Get coords adjacent to coord, from the given coords
@@ -34,7 +43,7 @@ def get_adjacent_coords(coord, coords):
 
 # Is coord 1 adjacent to coord 2?
 def is_adjacent_to_coord(coord1, coord2):
-    return coord1 in get_coord_neighbors(coord2)
+    return get_absolute_distance(coord1, coord2) == 1
 
 
 # Is the given coord adjacent to any of the given coords?
@@ -0,0 +1,11 @@
+# Load the app, and warm it up, once in the master process, so every worker is forked
+# with the lookup tables already built and answers its first move as fast as its hundredth
+preload_app = True
+
+worker_class = 'gevent'
+
+
+def when_ready(server):
+    from app.main import warm_up
+
+    warm_up()